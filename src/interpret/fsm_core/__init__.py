@@ -1 +1 @@
-from .fsm_core import State, Transition, FSM
\ No newline at end of file
+from .fsm_core import State, Transition, FSM, Variables, condition_always_true, njit_if_available, buffered_print, flush_output
\ No newline at end of file
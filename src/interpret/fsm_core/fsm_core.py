@@ -1,13 +1,247 @@
+import ast
+import functools
+import sys
 import time
 import socket
+import selectors
 import json
 import threading
+import struct
+import queue
 import logging
+from types import MappingProxyType
+
+# JSON codec of the client protocol: orjson if installed, else ujson, else the standard json module.
+# _dumps returns bytes, _loads takes bytes, _JSONDecodeError is what _loads raises for invalid JSON.
+try:
+    import orjson # Optional, much faster JSON codec than the standard json module
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+    _JSONDecodeError = orjson.JSONDecodeError # Subclass of json.JSONDecodeError
+except ImportError:
+    try:
+        import ujson # Optional, slower than orjson but still faster than the json module
+        def _dumps(obj):
+            return ujson.dumps(obj).encode('utf-8') # Compact separators by default
+        _loads = ujson.loads
+        _JSONDecodeError = getattr(ujson, "JSONDecodeError", ValueError) # Missing in older ujson releases
+    except ImportError:
+        def _dumps(obj):
+            return json.dumps(obj, separators=(",", ":")).encode('utf-8')
+        _loads = json.loads
+        _JSONDecodeError = json.JSONDecodeError
+
+try:
+    import numba # Optional, compiles numeric transition functions of generated FSMs to native code
+except ImportError:
+    numba = None
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - FSM - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Message prefixes are constant, so each one is encoded only once (see CommunicationProtocol.md)
+_MESSAGE_PREFIXES = {}
+
+def _message_prefix(message_type):
+    """Returns the pre-encoded '{"type":"<message_type>","payload":' start of a client message."""
+    prefix = _MESSAGE_PREFIXES.get(message_type)
+    if prefix is None:
+        prefix = _MESSAGE_PREFIXES[message_type] = ('{"type":' + json.dumps(message_type) + ',"payload":').encode('utf-8')
+    return prefix
+
+for _message_type in ("FSM_CONNECTED", "FSM_STARTED", "FSM_ERROR", "FSM_STUCK", "FSM_STOPPED", "FSM_FINISHED",
+                      "CURRENT_STATE", "STATE_ACTION_EXECUTED", "TRANSITION_TAKEN", "TRANSITION_ACTION_EXECUTED",
+                      "VARIABLE_UPDATE"):
+    _message_prefix(_message_type)
+
+# Binary framing, used with FSM(framing='binary') instead of JSON lines (see CommunicationProtocol.md).
+# Every frame is <message id: u8><payload length: u32><payload>, both directions, little-endian.
+_MESSAGE_IDS = {
+    "FSM_CONNECTED": 1, "FSM_STARTED": 2, "FSM_ERROR": 3, "FSM_STUCK": 4, "FSM_STOPPED": 5,
+    "FSM_FINISHED": 6, "CURRENT_STATE": 7, "STATE_ACTION_EXECUTED": 8, "TRANSITION_TAKEN": 9,
+    "TRANSITION_ACTION_EXECUTED": 10, "VARIABLE_UPDATE": 11,
+    "SET_VARIABLE": 32, "STOP_FSM": 33,
+}
+_MESSAGE_NAMES = {message_id: name for name, message_id in _MESSAGE_IDS.items()}
+_FRAME_HEADER = struct.Struct('<BI')
+# Payloads of the per-step messages refer to states by their index (order of FSM.add_state);
+# all other payloads are compact JSON
+_PACK_STATE = struct.Struct('<H').pack                  # state
+_PACK_STATE_FLAG = struct.Struct('<HB').pack            # state, is_finish
+_PACK_TRANSITION = struct.Struct('<HH').pack            # from_state, to_state
+_PACK_TRANSITION_DELAY = struct.Struct('<HHd').pack     # from_state, to_state, delay
+
+# Length framing, used with FSM(framing='length'): every message is the usual JSON object
+# (without the newline) preceded by its length, so no side has to scan for line ends
+_LENGTH_HEADER = struct.Struct('>I')
+
+# Most chunks handed to a single sendmsg() call, well below the usual IOV_MAX of 1024
+_MAX_SEND_CHUNKS = 64
+
+def _send_chunks(sock, chunks):
+    """Sends all chunks (bytes objects) like sendall(), with as few syscalls as possible."""
+    if len(chunks) == 1 or not hasattr(sock, "sendmsg"): # No sendmsg() on Windows
+        sock.sendall(b"".join(chunks))
+        return
+    while chunks:
+        sent = sock.sendmsg(chunks)
+        # Drop what was sent, sendmsg() may send only a part like send()
+        while chunks and sent >= len(chunks[0]):
+            sent -= len(chunks[0])
+            chunks = chunks[1:]
+        if chunks and sent:
+            chunks[0] = chunks[0][sent:]
+
+# Linux only, ACKs client messages immediately instead of delaying them
+_TCP_QUICKACK = getattr(socket, "TCP_QUICKACK", None)
+
+def _tune_client_socket(conn):
+    """Sets up the client connection for many small messages (no Nagle delay, larger buffers)."""
+    try:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        if _TCP_QUICKACK is not None:
+            # Set once: most client messages are answered (e.g. VARIABLE_UPDATE), which carries the ACK anyway
+            conn.setsockopt(socket.IPPROTO_TCP, _TCP_QUICKACK, 1)
+    except OSError as e:
+        logger.warning(f"Could not tune client socket: {e}")
+
+# Output of buffered_print() while an FSM runs, written to stdout in batches by flush_output()
+_PRINT_FLUSH_SIZE = 1 << 16   # Written at once when this many characters are collected
+_PRINT_FLUSH_INTERVAL = 0.1   # Otherwise at most this many seconds late
+_print_buf = []
+_print_size = 0
+_print_flush_time = 0.0       # time.monotonic() when the collected output is due
+_print_batching = 0           # Number of running FSMs, output is collected only while nonzero
+_print_lock = threading.Lock() # flush_output() is also called by client handler threads (set_variable)
+
+def buffered_print(*args, sep=' ', end='\n', file=None, flush=False):
+    """
+    Drop-in replacement of print() for FSM actions, generated scripts use it as their print.
+
+    While an FSM runs, output to stdout is collected and written by the FSM in batches
+    (once per _PRINT_FLUSH_INTERVAL, before delays and when it stops) instead of a write
+    per call. Otherwise it is plain print().
+    """
+    global _print_size
+    if not _print_batching or file is not None:
+        print(*args, sep=sep, end=end, file=file, flush=flush)
+        return
+    text = (' ' if sep is None else sep).join(map(str, args)) + ('\n' if end is None else end)
+    with _print_lock:
+        _print_buf.append(text)
+        _print_size += len(text)
+        due = flush or _print_size >= _PRINT_FLUSH_SIZE
+    if due:
+        flush_output()
+
+def flush_output():
+    """Writes the output collected by buffered_print() to stdout."""
+    global _print_size, _print_flush_time
+    with _print_lock: # Written under the lock, so concurrent flushes neither repeat nor reorder output
+        if _print_buf:
+            sys.stdout.write("".join(_print_buf))
+            sys.stdout.flush()
+            _print_buf.clear()
+            _print_size = 0
+        _print_flush_time = time.monotonic() + _PRINT_FLUSH_INTERVAL
+
+def _set_print_batching(enabled):
+    """Starts (True) or ends (False) collecting buffered_print() output for a running FSM."""
+    global _print_batching
+    _print_batching += 1 if enabled else -1
+    flush_output()
+
+def njit_if_available(func):
+    """
+    Decorator compiling a function with numba.njit(cache=True) if numba is installed.
+
+    Meant for the transition functions of generated FSMs with numeric variables only.
+    Without numba, or if numba cannot compile the function for the given argument types
+    (e.g. a variable is not set yet), the plain Python function is used.
+    """
+    if numba is None:
+        return func
+    jitted = numba.njit(cache=True)(func)
+    impl = [jitted]
+    def call(*args):
+        try:
+            return impl[0](*args)
+        except numba.core.errors.NumbaError as e: # e.g. TypingError
+            logger.warning(f"numba cannot compile {func.__name__}, using plain Python: {e}")
+            impl[0] = func
+            return func(*args)
+    call.__name__ = func.__name__
+    call.__doc__ = func.__doc__
+    return call
+
+class Variables:
+    """
+    Base of slot-based FSM variable classes, see FSM(variables_class=...).
+
+    A subclass lists the variable names in __slots__, actions and conditions then read a
+    variable as an attribute (variables.x) instead of a dict lookup. Like the variables dict,
+    a published instance is never modified in place.
+
+    A variable whose name would clash with the attributes of this class (e.g. "get") is kept
+    in a slot of another name, _renamed maps such variable names to their slot names.
+    """
+    __slots__ = ()
+    _renamed = {}
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    def get(self, name, default=None):
+        return getattr(self, self._renamed.get(name, name), default)
+
+    def _slot(self, name):
+        """Returns the slot name of the variable name, or None if there is no such variable."""
+        slot = self._renamed.get(name, name)
+        return slot if slot in self.__slots__ else None
+
+    def _copy(self):
+        """Returns a copy that can be modified before it is published."""
+        new = object.__new__(type(self))
+        for slot in self.__slots__:
+            setattr(new, slot, getattr(self, slot))
+        return new
+
+    def _replace(self, name, value):
+        """Returns a copy with the variable name set to value."""
+        slot = self._slot(name)
+        if slot is None:
+            raise KeyError(f"Unknown variable '{name}'.")
+        new = self._copy()
+        setattr(new, slot, value)
+        return new
+
+def condition_always_true(fsm, variables):
+    """Condition of transitions without one, recognized by the FSM and never actually called."""
+    return True
+
+@functools.lru_cache(maxsize=512)
+def _compile_condition(expr):
+    """
+    Compiles a condition expression for Transition.from_expr. Automata often repeat the same
+    condition on many transitions, so the compiled function is cached and shared.
+    """
+    tree = ast.parse(expr, mode='eval')
+    var_deps = tuple(dict.fromkeys(node.id for node in ast.walk(tree) if isinstance(node, ast.Name)))
+    namespace = {"__builtins__": {}}
+    exec(compile(f"def condition({', '.join(var_deps)}):\n    return True if ({expr}) else False",
+                 f"<condition '{expr}'>", 'exec'), namespace)
+    condition = namespace["condition"]
+    condition.__var_deps__ = var_deps
+    return condition
 
 class Transition:
+    # FSMs are built from many small State/Transition objects, slots keep them compact
+    __slots__ = ('target_state_name', 'condition', 'action', 'delay', '_target', '_expr', '_always')
+
     def __init__(self, target_state_name, condition=None, action=None, delay=0.0):
         """
         Represents a transition between states.
@@ -17,22 +251,58 @@ class Transition:
             condition (callable, optional): A function that takes an FSM instance and a
                                            dictionary of FSM variables, returning True if
                                            the transition can be taken. Defaults to always True.
+                                           A condition with a __var_deps__ tuple of variable
+                                           names is instead called with just the values of
+                                           those variables, as positional arguments.
             action (callable, optional): A function to execute when this transition is taken.
                                         It takes a dictionary of FSM variables (live).
             delay (float, optional): Time in miliseconds to wait before completing the transition.
 
                                      Defaults to 0.0.
         """
-        self.target_state_name = target_state_name
+        # Interned like state names, so looking it up in the FSM's state tables is a pointer compare
+        self.target_state_name = sys.intern(target_state_name)
         # Condition now expects (fsm_instance, variables_dict)
-        self.condition = condition if callable(condition) else lambda _fsm, _variables: True
+        self.condition = condition if callable(condition) else condition_always_true
+        self._always = self.condition is condition_always_true # Taken without calling the condition
         self.action = action
         self.delay = delay # Assumed to be in seconds
+        self._target = None # Target State object, resolved by FSM.finalize()
+        self._expr = None   # Source of the condition if created by from_expr()
+
+    @classmethod
+    def from_expr(cls, target_state_name, expr, action=None, delay=0.0):
+        """
+        Creates a transition whose condition is given as a Python expression.
+
+        The expression is compiled only once into a function of the variables it uses
+        (see __var_deps__ in Transition), e.g. "x > 0 and y == 'on'" becomes
+        condition(x, y). Only the FSM variables are available to it, there are no builtins.
+
+        Args:
+            target_state_name (str): The name of the state this transition leads to.
+            expr (str): The condition expression.
+            action (callable, optional): See Transition.
+            delay (float, optional): See Transition.
+
+        Returns:
+            Transition: The new transition.
+
+        Raises:
+            SyntaxError: If expr is not a valid Python expression.
+        """
+        condition = _compile_condition(expr)
+        transition = cls(target_state_name, condition=condition, action=action, delay=delay)
+        transition._expr = expr
+        return transition
 
     def __repr__(self):
         return f"<Transition to '{self.target_state_name}' delay={self.delay}s>"
 
 class State:
+    __slots__ = ('name', 'action', 'is_start_state', 'is_finish_state', 'transitions',
+                 '_t_conds', '_t_targets', '_t_delays', '_t_actions', '_t_next', '_pick', '_always_first')
+
     def __init__(self, name, action=None, is_start_state=False, is_finish_state=False):
         """
         Represents a state in the FSM.
@@ -40,41 +310,172 @@ class State:
         Args:
             name (str): The unique name of the state.
             action (callable, optional): A function to execute upon entering this state.
-                                        It takes (fsm_instance, variables_dict_copy).
+                                        It takes (fsm_instance, variables_dict), the dict is a
+                                        private copy of the FSM variables (changes to it are not
+                                        published, use fsm_instance.set_variable for that).
             is_start_state (bool, optional): True if this is the starting state. Defaults to False.
             is_finish_state (bool, optional): True if this is a finish state. Defaults to False.
         """
-        self.name = name
+        self.name = sys.intern(name) # Used as key of the FSM's state tables
         self.action = action
         self.is_start_state = is_start_state
         self.is_finish_state = is_finish_state
         self.transitions = []
+        # Transition fields as parallel tuples (indexed like self.transitions) and the fused
+        # condition function, all built by _compile_transitions()
+        self._t_conds = ()
+        self._t_targets = ()
+        self._t_delays = ()
+        self._t_actions = ()
+        self._t_next = () # Target State objects, resolved by FSM.finalize()
+        self._pick = None
+        self._always_first = False # First transition is unconditional, FSM.run takes it without picking
 
     def add_transition(self, transition):
         """Adds a transition originating from this state."""
         if not isinstance(transition, Transition):
             raise TypeError("transition must be an instance of Transition class")
+        if isinstance(self.transitions, tuple): # Frozen by FSM.finalize()
+            self.transitions = list(self.transitions)
         self.transitions.append(transition)
+        self._pick = None # Transition list changed, it has to be compiled again
+
+    def _compile_transitions(self):
+        """
+        Prepares the outgoing transitions for FSM.run.
+
+        Copies the transition fields into the parallel _t_* tuples and compiles the conditions
+        of all transitions into a single picker function. The picker takes (fsm_instance,
+        variables_dict) and returns the index of the first transition whose condition holds,
+        or -1 if none does. This replaces the per-transition loop (and its per-transition
+        overhead) in FSM.run. Conditions made by Transition.from_expr are inlined into the
+        picker as expressions, so evaluating them needs no call at all.
+
+        Returns:
+            callable: The compiled picker, also cached as self._pick.
+        """
+        self._t_conds = tuple(t.condition for t in self.transitions)
+        self._t_targets = tuple(t.target_state_name for t in self.transitions)
+        self._t_delays = tuple(t.delay for t in self.transitions)
+        self._t_actions = tuple(t.action for t in self.transitions)
+        self._always_first = bool(self.transitions) and self.transitions[0]._always
+
+        # Like the conditions made by Transition.from_expr, the picker has no builtins
+        namespace = {"__builtins__": {}}
+        source = ["def _pick(_fsm, _variables):", "    _get = _variables.get"]
+        loaded = set() # Variables already loaded into picker locals
+        for i, condition in enumerate(self._t_conds):
+            transition = self.transitions[i]
+            if transition._always:
+                source.append(f"    return {i}")
+                break # Transitions after it can never be taken
+            var_deps = getattr(condition, "__var_deps__", None)
+            if transition._expr is not None and not any(name.startswith("_") for name in var_deps):
+                # Expression condition: inlined, so it is evaluated without a call
+                for name in var_deps:
+                    if name not in loaded:
+                        source.append(f"    {name} = _get({name!r})")
+                        loaded.add(name)
+                source.append(f"    if ({transition._expr}): return {i}")
+                continue
+            namespace[f"_cond{i}"] = condition
+            if var_deps is None:
+                source.append(f"    if _cond{i}(_fsm, _variables): return {i}")
+            else: # Pass only the variables the condition depends on
+                args = ", ".join(f"_get({name!r})" for name in var_deps)
+                source.append(f"    if _cond{i}({args}): return {i}")
+        source.append("    return -1")
+        exec("\n".join(source), namespace)
+        self._pick = namespace["_pick"]
+        return self._pick
 
     def __repr__(self):
         return f"<State '{self.name}' Start={self.is_start_state} Finish={self.is_finish_state}>"
 
 class FSM:
-    def __init__(self):
+    """
+    Finite state machine run against a single TCP client.
+
+    Variables are copy-on-write: self.variables is never modified in place, writers build a
+    new dict (or Variables instance) and publish it by rebinding the attribute while holding
+    _mutation_lock, which only serializes writers. Readers (conditions, actions, get_variable)
+    use the current object as a consistent snapshot without any locking. A dict is published
+    wrapped in a read-only MappingProxyType, so a reader cannot modify it by mistake.
+    """
+    def __init__(self, verbose=True, framing='json', variables_class=None):
+        if framing not in ('json', 'binary', 'length'):
+            raise ValueError(f"Unknown framing '{framing}', expected 'json', 'binary' or 'length'.")
         self.states = {}  # name: State object
-        self.variables = {}
+        self._state_idx = {} # name: index of the state in binary frames
+        self._framing = framing
+        # Never modified in place (see FSM), readers use the current dict as a snapshot without locking.
+        # With a variables_class (a Variables subclass) it is an instance of that class instead.
+        self.variables = variables_class() if variables_class else MappingProxyType({})
         self.current_state = None
         self.start_state_name = None
         self._client_socket = None
         self._client_address = None
+        # True while the client connection is usable, sends become no-ops once it is cleared
+        self._connected = False
+        self._connection_lock = threading.Lock() # Makes clearing _connected a test-and-set
         self._stop_event = threading.Event()
-        self._variable_lock = threading.Lock() # To protect access to self.variables
+        self._verbose = verbose # Send per-step CURRENT_STATE / STATE_ACTION_EXECUTED messages to the client
+        self._mutation_lock = threading.Lock() # Serializes writers of self.variables
         self._client_handler_thread = None
+        # Handlers of client messages by message type, each takes the message payload
+        self._inbound = {"SET_VARIABLE": self._on_set_variable, "STOP_FSM": self._on_stop_fsm}
+        # Self-pipe used by stop() to wake up threads blocked waiting for socket readiness
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_w.setblocking(False)
+        # Outgoing messages queued by _queue_to_client, handed over at once by _flush_to_client
+        self._send_buf = bytearray()
+        self._send_lock = threading.Lock()
+        # Flushed data waiting for the writer thread, so the FSM thread never blocks on the socket
+        self._send_q = queue.Queue(maxsize=1024)
+        self._writer_thread = None
+        self._client_stalled = False # Set when a stopping FSM gave up waiting for the client to read
+        self._state_messages = {} # (message type, state name): encoded message, see _queue_state_message
+        self._print_batching = False # True while buffered_print() output is collected for this FSM
 
         # For interruptible delays
         self._re_evaluate_event = threading.Event()
         self._current_delay_target_transition = None # Stores the Transition object being delayed
-        self._current_delay_end_time = None          # Stores the end time for the current delay
+
+    @classmethod
+    def from_tables(cls, states, transitions, start_state_id=0, **kwargs):
+        """
+        Creates an FSM from literal tables instead of State/Transition constructor calls.
+
+        The states table has the same layout as the one taken by run_compiled(), so a script
+        can describe its automaton with module-level tuples only.
+
+        Args:
+            states (sequence): (name, action, is_finish_state) of every state, indexed by state id.
+            transitions (sequence): (from_state_id, to_state_id, condition, delay) of every
+                                    transition, in the order they are tried. The condition is
+                                    a callable (see Transition), an expression string (see
+                                    Transition.from_expr) or None for an unconditional transition.
+            start_state_id (int, optional): Id of the start state. Defaults to 0.
+            **kwargs: Passed to the FSM constructor.
+
+        Returns:
+            FSM: The new FSM, with all its states added.
+        """
+        # Transitions indexed by source state id, so each state gets its own list at once
+        outgoing = [[] for _ in states]
+        for from_sid, to_sid, condition, delay in transitions:
+            target = states[to_sid][0]
+            if isinstance(condition, str):
+                outgoing[from_sid].append(Transition.from_expr(target, condition, delay=delay))
+            else:
+                outgoing[from_sid].append(Transition(target, condition=condition, delay=delay))
+
+        fsm = cls(**kwargs)
+        for sid, (name, action, is_finish) in enumerate(states):
+            state = State(name, action=action, is_start_state=sid == start_state_id, is_finish_state=is_finish)
+            state.transitions = outgoing[sid]
+            fsm.add_state(state)
+        return fsm
 
     def add_state(self, state):
         if not isinstance(state, State):
@@ -82,86 +483,348 @@ class FSM:
         if state.name in self.states:
             raise ValueError(f"State with name '{state.name}' already exists.")
         self.states[state.name] = state
+        self._state_idx[state.name] = len(self._state_idx)
+        state._compile_transitions()
         if state.is_start_state:
             if self.start_state_name is not None:
                 raise ValueError("Multiple start states defined. Only one is allowed.")
             self.start_state_name = state.name
-        logging.info(f"Added state: {state.name}")
+        logger.info("Added state: %s", state.name)
+
+    def finalize(self):
+        """
+        Resolves the target state names of all transitions to State objects.
+
+        The transition lists of the states are frozen into tuples, as nothing is added
+        to them while the FSM runs.
+
+        Called by run(), but can be called earlier to validate the FSM once all states
+        have been added.
+
+        Raises:
+            ValueError: If a transition leads to a state that was not added to the FSM.
+        """
+        for state in self.states.values():
+            state.transitions = tuple(state.transitions)
+            if state._pick is None:
+                state._compile_transitions()
+            for transition in state.transitions:
+                target = self.states.get(transition.target_state_name)
+                if target is None:
+                    raise ValueError(f"Target state '{transition.target_state_name}' of a transition "
+                                     f"from '{state.name}' not found.")
+                transition._target = target
+            state._t_next = tuple(t._target for t in state.transitions)
 
     def set_variable(self, name, value):
-        with self._variable_lock:
-            self.variables[name] = value
-        logging.info(f"Variable '{name}' set to '{value}'")
+        with self._mutation_lock:
+            if isinstance(self.variables, Variables):
+                variables = self.variables._replace(name, value)
+            else:
+                variables = dict(self.variables)
+                variables[name] = value
+                variables = MappingProxyType(variables)
+            self.variables = variables # Rebinding is atomic, readers see the old or the new dict
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Variable '%s' set to '%s'", name, value)
         self._send_to_client("VARIABLE_UPDATE", {"name": name, "value": value})
 
         # If FSM is in a delay, signal re-evaluation
         # Check stop_event to avoid signaling if FSM is already stopping
         if self._current_delay_target_transition and not self._stop_event.is_set():
-            logging.debug(f"Signaling re-evaluation for state {self.current_state.name} due to variable change during delay.")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Signaling re-evaluation due to variable change during delay.")
             self._re_evaluate_event.set()
 
 
     def get_variable(self, name, default=None):
-        with self._variable_lock:
-            return self.variables.get(name, default)
+        return self.variables.get(name, default) # Published snapshot, no lock needed
+
+    def _private_variables(self):
+        """Returns a copy of the published variables that a state action may modify."""
+        variables = self.variables
+        if isinstance(variables, Variables):
+            return variables._copy()
+        return dict(variables)
 
     def _send_to_client(self, message_type, payload=None):
-        if self._client_socket:
+        if not self._connected:
+            return
+        self._queue_to_client(message_type, payload)
+        self._flush_to_client()
+
+    def _queue_to_client(self, message_type, payload=None):
+        """Appends a message to the send buffer, it is sent by the next _flush_to_client()."""
+        if self._connected:
+            data = self._encode(message_type, payload)
+            with self._send_lock:
+                self._send_buf += data
+
+    def _queue_state_message(self, message_type, name, payload):
+        """
+        Like _queue_to_client(), for the per-step messages whose payload only depends on the
+        state (CURRENT_STATE, STATE_ACTION_EXECUTED). Each is encoded once per state and reused.
+        """
+        if self._connected:
+            data = self._state_messages.get((message_type, name))
+            if data is None:
+                data = self._state_messages[(message_type, name)] = self._encode(message_type, payload)
+            with self._send_lock:
+                self._send_buf += data
+
+    def _encode(self, message_type, payload):
+        """Returns a client message encoded for the framing in use."""
+        if self._framing == 'binary':
+            return self._encode_binary(message_type, payload or {})
+        if self._framing == 'length':
+            body = _message_prefix(message_type) + _dumps(payload or {}) + b'}'
+            return _LENGTH_HEADER.pack(len(body)) + body
+        return _message_prefix(message_type) + _dumps(payload or {}) + b'}\n'
+
+    def _encode_binary(self, message_type, payload):
+        """Returns the binary frame of a client message."""
+        idx = self._state_idx
+        if message_type == "CURRENT_STATE":
+            body = _PACK_STATE_FLAG(idx[payload["name"]], payload["is_finish"])
+        elif message_type == "TRANSITION_TAKEN":
+            body = _PACK_TRANSITION_DELAY(idx[payload["from_state"]], idx[payload["to_state"]], payload["delay"])
+        elif message_type == "TRANSITION_ACTION_EXECUTED":
+            body = _PACK_TRANSITION(idx[payload["from_state"]], idx[payload["to_state"]])
+        elif message_type == "STATE_ACTION_EXECUTED":
+            body = _PACK_STATE(idx[payload["state_name"]])
+        elif message_type == "FSM_STUCK":
+            body = _PACK_STATE(idx[payload["state_name"]])
+        elif message_type == "FSM_FINISHED":
+            body = _PACK_STATE(idx[payload["finish_state"]])
+        else:
+            body = _dumps(payload)
+        return _FRAME_HEADER.pack(_MESSAGE_IDS[message_type], len(body)) + body
+
+    def _flush_to_client(self):
+        """Hands all queued messages over to the writer thread as a single chunk."""
+        if _print_buf and time.monotonic() >= _print_flush_time:
+            flush_output() # Called once per state, also a good time to write due action output
+        with self._send_lock:
+            if not self._send_buf:
+                return
+            data = bytes(self._send_buf)
+            self._send_buf.clear()
+        try:
+            self._send_q.put_nowait(data)
+        except queue.Full:
+            self._put_when_sent(data)
+
+    def _put_when_sent(self, data, closing=False):
+        """
+        Backpressure for a client that is not keeping up: blocks until the writer thread takes
+        data, so no message (e.g. FSM_FINISHED, FSM_ERROR) is lost.
+
+        Gives up only when the client is gone, or when the FSM is stopping (or closing is True)
+        and the writer has not taken anything for 1 s, so a client that stopped reading cannot
+        keep the FSM from shutting down.
+
+        Args:
+            data (bytes or None): Chunk for the writer thread, None tells it to exit.
+            closing (bool, optional): True when called by _cleanup(). Defaults to False.
+
+        Returns:
+            bool: True if data was queued.
+        """
+        give_up_time = None
+        while True:
             try:
-                message = {"type": message_type, "payload": payload or {}}
-                self._client_socket.sendall((json.dumps(message) + "\n").encode('utf-8'))
-            except (socket.error, BrokenPipeError) as e:
-                logging.error(f"Error sending message to client: {e}. Client might have disconnected.")
+                self._send_q.put(data, timeout=0.1)
+                return True
+            except queue.Full:
+                if not self._connected:
+                    return False # Nobody left to send to, the writer just drains the queue
+                if closing or self._stop_event.is_set():
+                    if self._client_stalled:
+                        return False # Already waited for this client in vain, do not wait again
+                    size = self._send_q.qsize()
+                    if give_up_time is None or size < last_size: # Started waiting or the writer made progress
+                        give_up_time = time.monotonic() + 1.0
+                        last_size = size
+                    elif time.monotonic() >= give_up_time:
+                        logger.warning("Client not reading, dropped the remaining client messages.")
+                        self._client_stalled = True
+                        return False
+
+    def _write_to_client(self):
+        """
+        Writer thread: sends chunks from the send queue until it gets None.
+
+        All chunks already waiting in the queue are sent together with a single
+        scatter/gather sendmsg() call (one syscall instead of one per chunk).
+        """
+        running = True
+        while running:
+            chunks = [self._send_q.get()]
+            while len(chunks) < _MAX_SEND_CHUNKS:
+                try:
+                    chunks.append(self._send_q.get_nowait())
+                except queue.Empty:
+                    break
+            if None in chunks:
+                running = False
+                chunks = chunks[:chunks.index(None)]
+            if not chunks or not self._connected:
+                continue # Nothing to send, or disconnected and just draining the queue
+            try:
+                _send_chunks(self._client_socket, chunks)
+            except (socket.error, BrokenPipeError, AttributeError) as e:
+                logger.error(f"Error sending message to client: {e}. Client might have disconnected.")
                 self._handle_disconnection()
+        logger.info("Client writer thread finished.")
+
 
+    def _process_client_message(self, message_type, payload):
+        """Acts on a decoded client message by calling its handler from self._inbound."""
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Received from client: %s %s", message_type, payload)
+        handler = self._inbound.get(message_type)
+        if handler:
+            handler(payload)
+
+    def _on_set_variable(self, payload):
+        var_name = payload.get("name")
+        if var_name is None:
+            return
+        variables = self.variables
+        if isinstance(variables, Variables) and variables._slot(var_name) is None:
+            # Slot-based variables cannot get new names, the FSM keeps running without it
+            logger.warning("Client tried to set unknown variable '%s'.", var_name)
+            self._send_to_client("FSM_ERROR", {"message": f"Unknown variable '{var_name}'."})
+            return
+        self.set_variable(var_name, payload.get("value"))
+
+    def _on_stop_fsm(self, payload):
+        logger.info("Received STOP_FSM command from client.")
+        self.stop()
 
     def _handle_client_messages(self):
-        buffer = ""
+        if self._framing == 'json':
+            self._read_client_lines()
+            return
+        # Reused receive buffer, frames are parsed in place between start and end
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
+        start = end = 0
+        selector = selectors.DefaultSelector()
         try:
+            selector.register(self._client_socket, selectors.EVENT_READ)
+            selector.register(self._wake_r, selectors.EVENT_READ)
             while not self._stop_event.is_set() and self._client_socket:
+                # Block until the client sends something or stop() wakes us up
+                events = selector.select()
+                if any(key.fileobj is self._wake_r for key, _ in events):
+                    break
                 try:
-                    self._client_socket.settimeout(0.5)
-                    data = self._client_socket.recv(1024)
-                    if not data:
-                        logging.info("Client disconnected gracefully.")
+                    if end == len(buffer):
+                        # No room left: move the unprocessed bytes to the front,
+                        # or grow the buffer if a single frame fills all of it
+                        if start:
+                            buffer[:end - start] = buffer[start:end]
+                            end -= start
+                            start = 0
+                        else:
+                            view.release()
+                            buffer.extend(bytes(len(buffer)))
+                            view = memoryview(buffer)
+                    received = self._client_socket.recv_into(view[end:])
+                    if not received:
+                        logger.info("Client disconnected gracefully.")
                         self._handle_disconnection()
                         break
-                    
-                    buffer += data.decode('utf-8')
-                    
-                    while '\n' in buffer:
-                        message_str, buffer = buffer.split('\n', 1)
-                        if not message_str.strip(): continue
-                        try:
-                            message = json.loads(message_str)
-                            logging.info(f"Received from client: {message}")
-                            if message.get("type") == "SET_VARIABLE":
-                                var_name = message.get("payload", {}).get("name")
-                                var_value = message.get("payload", {}).get("value")
-                                if var_name is not None:
-                                    self.set_variable(var_name, var_value)
-                            elif message.get("type") == "STOP_FSM":
-                                logging.info("Received STOP_FSM command from client.")
-                                self.stop()
-                        except json.JSONDecodeError:
-                            logging.warning(f"Invalid JSON received from client: {message_str}")
-                        except Exception as e:
-                            logging.error(f"Error processing client message: {e}")
-                except socket.timeout:
-                    continue 
+
+                    end += received
+                    start = self._process_client_frames(view, start, end)
+                    if start == end:
+                        start = end = 0 # All processed, start over at the front
                 except socket.error as e:
-                    logging.error(f"Socket error in client handler: {e}")
+                    logger.error(f"Socket error in client handler: {e}")
                     self._handle_disconnection()
                     break
         except Exception as e:
-            logging.error(f"Client handler thread encountered an error: {e}")
+            logger.error(f"Client handler thread encountered an error: {e}")
         finally:
-            logging.info("Client message handler thread finished.")
+            selector.close()
+            logger.info("Client message handler thread finished.")
+
+
+    def _process_client_frames(self, data, start, end):
+        """
+        Processes the complete binary or length framed messages in data[start:end].
+
+        Args:
+            data (memoryview): The receive buffer.
+            start (int): Offset of the first unprocessed byte.
+            end (int): Offset after the last received byte.
 
+        Returns:
+            int: Offset of the first byte not processed yet (an incomplete last frame).
+        """
+        binary = self._framing == 'binary'
+        header = _FRAME_HEADER if binary else _LENGTH_HEADER
+        header_size = header.size
+        while end - start >= header_size:
+            if binary:
+                message_id, length = header.unpack_from(data, start)
+            else:
+                (length,) = header.unpack_from(data, start)
+            if end - start < header_size + length:
+                break # Frame not complete yet
+            body = bytes(data[start + header_size:start + header_size + length]) # The only copy made
+            start += header_size + length
+            try:
+                if binary:
+                    self._process_client_message(_MESSAGE_NAMES.get(message_id), _loads(body) if body else {})
+                else:
+                    message = _loads(body)
+                    self._process_client_message(message.get("type"), message.get("payload") or {})
+            except _JSONDecodeError:
+                logger.warning(f"Invalid JSON payload received from client: {body}")
+            except Exception as e:
+                logger.error(f"Error processing client message: {e}")
+        return start
+
+    def _read_client_lines(self):
+        """
+        Reads JSON lines from the client until it disconnects or the connection is shut down.
+
+        Line framing is left to the buffered reader of socket.makefile(), which does it in C
+        and reads up to 64 KiB per syscall. The read blocks until data arrives, _cleanup()
+        ends it by shutting the socket down.
+        """
+        reader = self._client_socket.makefile('rb', buffering=65536)
+        try:
+            for message_str in reader:
+                if not message_str.strip(): continue
+                try:
+                    message = _loads(message_str)
+                    self._process_client_message(message.get("type"), message.get("payload") or {})
+                except _JSONDecodeError:
+                    logger.warning(f"Invalid JSON received from client: {message_str}")
+                except Exception as e:
+                    logger.error(f"Error processing client message: {e}")
+            if self._connected: # Otherwise _cleanup() shut the connection down
+                logger.info("Client disconnected gracefully.")
+                self._handle_disconnection()
+        except (socket.error, ValueError) as e: # ValueError: socket closed under the reader
+            if self._connected:
+                logger.error(f"Socket error in client handler: {e}")
+                self._handle_disconnection()
+        finally:
+            reader.close()
+            logger.info("Client message handler thread finished.")
 
     def _handle_disconnection(self):
+        with self._connection_lock:
+            if not self._connected:
+                return # Already handled, e.g. both the reader and the writer noticed the lost connection
+            self._connected = False
         if self._client_socket:
-            logging.info(f"Handling disconnection from {self._client_address}")
+            logger.info("Handling disconnection from %s", self._client_address)
             # self._send_to_client("FSM_ERROR", {"message": "Client disconnected or connection lost."}) # Might fail if socket is bad
             self.stop() 
             try:
@@ -174,221 +837,400 @@ class FSM:
     def connect_to_client(self, host='localhost', port=12345):
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        selector = selectors.DefaultSelector()
         try:
             server_socket.bind((host, port))
             server_socket.listen(1)
-            logging.info(f"FSM Server listening on {host}:{port}")
+            logger.info("FSM Server listening on %s:%s", host, port)
             print(f"FSM Server: Waiting for a client connection on {host}:{port}...")
             
-            server_socket.settimeout(1.0) 
+            # Wait for the connection or for stop() to signal the wake-up socket, without polling
+            server_socket.setblocking(False)
+            selector.register(server_socket, selectors.EVENT_READ)
+            selector.register(self._wake_r, selectors.EVENT_READ)
             while not self._stop_event.is_set():
+                events = selector.select()
+                if any(key.fileobj is self._wake_r for key, _ in events):
+                    break
                 try:
                     conn, addr = server_socket.accept()
-                    self._client_socket = conn
-                    self._client_address = addr
-                    logging.info(f"Client connected from {addr}")
-                    print(f"FSM Server: Client connected from {addr}")
-                    self._send_to_client("FSM_CONNECTED", {"message": "Successfully connected to FSM."})
-                    
-                    self._client_handler_thread = threading.Thread(target=self._handle_client_messages, daemon=True)
-                    self._client_handler_thread.start()
+                    self.attach_client(conn, addr)
                     break 
-                except socket.timeout:
-                    continue 
+                except BlockingIOError:
+                    continue # Connection was gone again before we accepted it
                 except Exception as e:
-                    logging.error(f"Error accepting connection: {e}")
+                    logger.error(f"Error accepting connection: {e}")
                     self.stop() 
                     break
         except Exception as e:
-            logging.error(f"Could not start FSM server: {e}")
+            logger.error(f"Could not start FSM server: {e}")
             self.stop() 
         finally:
+            selector.close()
             server_socket.close() 
 
         if not self._client_socket and not self._stop_event.is_set():
-            logging.error("Failed to connect to any client. FSM cannot run.")
+            logger.error("Failed to connect to any client. FSM cannot run.")
             self.stop()
 
 
+    def attach_client(self, conn, addr):
+        """
+        Uses an already accepted connection as the client connection, like connect_to_client()
+        does once a client connects. Lets a server accept clients itself, e.g. runner.serve_many().
+
+        Args:
+            conn (socket.socket): The connected client socket.
+            addr: The client address, for logging.
+        """
+        conn.setblocking(True) # May be inherited from a non-blocking listening socket on some systems
+        _tune_client_socket(conn)
+        self._client_socket = conn
+        self._client_address = addr
+        self._connected = True
+        logger.info("Client connected from %s", addr)
+        print(f"FSM Server: Client connected from {addr}")
+        self._writer_thread = threading.Thread(target=self._write_to_client, daemon=True)
+        self._writer_thread.start()
+        self._send_to_client("FSM_CONNECTED", {"message": "Successfully connected to FSM."})
+
+        self._client_handler_thread = threading.Thread(target=self._handle_client_messages, daemon=True)
+        self._client_handler_thread.start()
+
+    def _wait_for_delay(self, delay, target, state_name, target_name):
+        """
+        Waits before completing a transition, unless a variable changes or the FSM is stopped.
+
+        Args:
+            delay (float): The transition delay in milliseconds.
+            target: The delayed transition, kept in _current_delay_target_transition while waiting.
+            state_name (str): Name of the state the transition leads from (for logging).
+            target_name (str): Name of the state the transition leads to (for logging).
+
+        Returns:
+            bool: True if the wait was interrupted and the transitions have to be re-evaluated.
+        """
+        self._current_delay_target_transition = target
+        delay_seconds = delay / 1000.0 # Convert milliseconds to seconds
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Starting delay of %.3fs for transition to %s", delay_seconds, target_name)
+        self._flush_to_client() # Client should see the transition before we start waiting
+        flush_output() # And the output of the state action
+
+        # A single timed wait: it returns early (True) when a variable changes or when
+        # stop() is called, since stop() also sets _re_evaluate_event. Its timeout is measured
+        # on the monotonic clock, so wall clock adjustments cannot stretch or cut the delay.
+        needs_re_evaluation = self._re_evaluate_event.wait(timeout=delay_seconds)
+        if needs_re_evaluation and not self._stop_event.is_set() and logger.isEnabledFor(logging.INFO):
+            logger.info("Re-evaluation signaled during delay for transition to %s. "
+                        "Restarting transition search for state %s.", target_name, state_name)
+
+        # Clear current delay tracking information as this delay attempt is over
+        self._current_delay_target_transition = None
+        return needs_re_evaluation
+
     def run(self):
-        if not self.start_state_name:
-            logging.error("No start state defined for the FSM.")
-            self._send_to_client("FSM_ERROR", {"message": "No start state defined."})
-            return
+        try: # Every exit, also the early ones for an invalid FSM, ends with _cleanup()
+            if not self.start_state_name:
+                logger.error("No start state defined for the FSM.")
+                self._send_to_client("FSM_ERROR", {"message": "No start state defined."})
+                return
 
-        if self.start_state_name not in self.states:
-            logging.error(f"Start state '{self.start_state_name}' not found in defined states.")
-            self._send_to_client("FSM_ERROR", {"message": f"Start state '{self.start_state_name}' not found."})
-            return
+            if self.start_state_name not in self.states:
+                logger.error(f"Start state '{self.start_state_name}' not found in defined states.")
+                self._send_to_client("FSM_ERROR", {"message": f"Start state '{self.start_state_name}' not found."})
+                return
 
-        self.current_state = self.states[self.start_state_name]
-        logging.info(f"FSM starting at state: {self.current_state.name}")
-        self._send_to_client("FSM_STARTED", {"start_state": self.current_state.name})
+            try:
+                self.finalize()
+            except ValueError as e:
+                logger.error(str(e))
+                self._send_to_client("FSM_ERROR", {"message": str(e)})
+                return
 
-        # Outer FSM loop: continues as long as FSM is not stopped and has a current state
-        while not self._stop_event.is_set() and self.current_state:
-            logging.info(f"--- Processing state: {self.current_state.name} ---")
-            self._send_to_client("CURRENT_STATE", {"name": self.current_state.name, "is_finish": self.current_state.is_finish_state})
+            self.current_state = self.states[self.start_state_name]
+            logger.info("FSM starting at state: %s", self.current_state.name)
+            started = {"start_state": self.current_state.name}
+            if self._framing == 'binary':
+                started["states"] = list(self._state_idx) # Names of the state indices used in binary frames
+            self._send_to_client("FSM_STARTED", started)
+            self._print_batching = True
+            _set_print_batching(True)
 
-            if self.current_state.action:
-                logging.info(f"Executing action for state {self.current_state.name}")
-                try:
-                    with self._variable_lock: vars_copy = self.variables.copy()
-                    self.current_state.action(self, vars_copy) # Pass FSM instance and vars copy
-                    self._send_to_client("STATE_ACTION_EXECUTED", {"state_name": self.current_state.name})
-                except Exception as e:
-                    logging.error(f"Error executing action for state {self.current_state.name}: {e}")
-                    self._send_to_client("FSM_ERROR", {"message": f"Action error in state {self.current_state.name}: {str(e)}"})
-                    self.stop(); break
+            stuck = False # Set when the FSM stops because no transition could be taken
+            # Bound methods and attributes used on every step, looked up once (locals are faster)
+            stop_is_set = self._stop_event.is_set
+            re_evaluate_clear = self._re_evaluate_event.clear
+            queue_message = self._queue_to_client
+            queue_state_message = self._queue_state_message
+            flush = self._flush_to_client
+            verbose = self._verbose
+            state = self.current_state # Synced back to self.current_state at state boundaries
+
+            # Outer FSM loop: continues as long as FSM is not stopped and has a current state
+            while not stop_is_set() and state:
+                name = state.name
+                log_info = logger.isEnabledFor(logging.INFO) # Checked once per processed state
+                if log_info:
+                    logger.info("--- Processing state: %s ---", name)
+                if verbose:
+                    queue_state_message("CURRENT_STATE", name, {"name": name, "is_finish": state.is_finish_state})
+
+                if state.action:
+                    if log_info:
+                        logger.info("Executing action for state %s", name)
+                    try:
+                        state.action(self, self._private_variables()) # Pass FSM instance and vars copy
+                        if verbose:
+                            queue_state_message("STATE_ACTION_EXECUTED", name, {"state_name": name})
+                    except Exception as e:
+                        self._report_error(f"Action error in state {name}", e); break
+
+                if stop_is_set(): break
 
-            if self._stop_event.is_set(): break
+                if state.is_finish_state:
+                    logger.info("Reached finish state: %s", name)
+                    queue_message("FSM_FINISHED", {"finish_state": name})
+                    break
 
-            if self.current_state.is_finish_state:
-                logging.info(f"Reached finish state: {self.current_state.name}")
-                self._send_to_client("FSM_FINISHED", {"finish_state": self.current_state.name})
-                break
+                # Inner loop for transition evaluation and execution for the current state.
+                # This loop continues until a state transition occurs, FSM stops, or gets stuck.
+                # It can be re-entered if a delay is interrupted by _re_evaluate_event.
+                pick = state._pick or state._compile_transitions()
+                while not stop_is_set():
+                    re_evaluate_clear() # Clear before evaluating transitions for this iteration
 
-            # Inner loop for transition evaluation and execution for the self.current_state.
-            # This loop continues until a state transition occurs, FSM stops, or gets stuck.
-            # It can be re-entered if a delay is interrupted by _re_evaluate_event.
+                    # 1. Evaluate transitions to find one to take (first valid one has the highest priority)
+                    if state._always_first:
+                        idx = 0 # Nothing to evaluate, not even a picker call
+                    else:
+                        try:
+                            idx = pick(self, self.variables) # Published snapshot, no lock or copy needed
+                        except Exception as e:
+                            self._report_error(f"Condition error for transition from {name}", e); break
+
+                    if stop_is_set(): break # from this inner transition processing loop
+
+                    if idx < 0:
+                        logger.warning(f"FSM stuck in state {name}: No valid transitions.")
+                        queue_message("FSM_STUCK", {"state_name": name})
+                        stuck = True
+                        self.stop(); break # Break from inner transition processing loop, FSM will stop
+
+                    # 2. A transition has been selected.
+                    target_name = state._t_targets[idx]
+                    delay = state._t_delays[idx]
+                    action = state._t_actions[idx]
+                    if log_info:
+                        logger.info("Selected transition: %s -> %s", name, target_name)
+                    queue_message("TRANSITION_TAKEN", {"from_state": name, "to_state": target_name, "delay": delay})
+
+                    if action:
+                        if log_info:
+                            logger.info("Executing action for transition: %s -> %s", name, target_name)
+                        try:
+                            with self._mutation_lock: # Action might read/write vars, it gets a private copy to publish
+                                if isinstance(self.variables, Variables):
+                                    variables = self.variables._copy()
+                                    action(variables)
+                                else:
+                                    variables = dict(self.variables)
+                                    action(variables)
+                                    variables = MappingProxyType(variables)
+                                self.variables = variables
+                            queue_message("TRANSITION_ACTION_EXECUTED", {"from_state": name, "to_state": target_name})
+                        except Exception as e:
+                            self._report_error("Transition action error", e); break # Break from inner transition processing loop
+
+                    if stop_is_set(): break
+
+                    # 3. Handle delay for the selected transition
+                    if delay > 0:
+                        needs_re_evaluation = self._wait_for_delay(delay, state.transitions[idx], name, target_name)
+
+                        if stop_is_set(): break # Break from inner transition processing loop
+
+                        if needs_re_evaluation:
+                            # Continue to the top of this inner "Transition evaluation..." loop
+                            # (which clears _re_evaluate_event) to re-scan all transitions from the state.
+                            continue 
+
+                        # If we are here, the single timed wait ran out: the delay is over.
+                        if log_info:
+                            logger.info("Delay completed for transition to %s.", target_name)
+                        # Proceed to change state (handled below this if-block)
+
+                    # 4. If delay is zero or completed (and not re-evaluating/stopped), perform the state change.
+                    # (Current delay tracking already cleared if delay was active)
+                    if log_info:
+                        logger.info("Completing transition: %s -> %s", name, target_name)
+                    state = self.current_state = state._t_next[idx] # Resolved and validated by finalize()
+                    # Successfully transitioned, break inner loop to process the new state in outer loop
+                    break 
+            
+                # End of inner "Transition evaluation..." loop.
+                # If this loop broke due to stop(), the outer loop's stop check will catch it.
+                # If it broke due to a state change, the outer loop continues with the new state.
+                flush() # One write per processed state
+
+            # FSM execution loop has ended
+            self._flush_to_client() # Messages queued right before the loop was left
+            if self._stop_event.is_set() and not self.current_state.is_finish_state : # only send FSM_STOPPED if not already finished
+                if not stuck : # Avoid duplicate FSM_STUCK vs FSM_STOPPED messages if stuck caused stop.
+                    logger.info("FSM run loop terminated by stop event.")
+                    self._send_to_client("FSM_STOPPED", {"message": "FSM was stopped."})
+        finally:
+            self._cleanup()
+
+    def run_compiled(self, step, states, start_state_id):
+        """
+        Runs an FSM given as a compiled transition function instead of State objects.
+
+        Used by the generated scripts, where step() has the conditions of all transitions
+        inlined. Sends the same messages to the client as run().
+
+        Args:
+            step (callable): step(state_id, variables) returns (next_state_id, delay) of the
+                             transition to take from the state, or None if there is none.
+            states (sequence): (name, action, is_finish_state) of every state, indexed by
+                               state id. The action is called like a State action, or is None.
+            start_state_id (int): Id of the start state.
+        """
+        try: # Every exit ends with _cleanup(), like in run()
+            if not 0 <= start_state_id < len(states):
+                logger.error(f"Start state id {start_state_id} not found in defined states.")
+                self._send_to_client("FSM_ERROR", {"message": f"Start state id {start_state_id} not found."})
+                return
+
+            self._state_idx = {name: i for i, (name, _action, _is_finish) in enumerate(states)}
+            self._state_messages.clear() # Binary frames refer to the state indices set just now
+            sid = start_state_id
+            logger.info("FSM starting at state: %s", states[sid][0])
+            started = {"start_state": states[sid][0]}
+            if self._framing == 'binary':
+                started["states"] = list(self._state_idx) # Names of the state indices used in binary frames
+            self._send_to_client("FSM_STARTED", started)
+            self._print_batching = True
+            _set_print_batching(True)
+
+            stuck = False
             while not self._stop_event.is_set():
-                self._re_evaluate_event.clear() # Clear before evaluating transitions for this iteration
+                name, action, is_finish = states[sid]
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("--- Processing state: %s ---", name)
+                if self._verbose:
+                    self._queue_state_message("CURRENT_STATE", name, {"name": name, "is_finish": is_finish})
 
-                # 1. Evaluate transitions to find one to take
-                transition_to_take = None
-                for t in self.current_state.transitions:
-                    with self._variable_lock: vars_copy = self.variables.copy()
-                    can_transit = False
+                if action:
                     try:
-                        can_transit = t.condition(self, vars_copy) # Pass FSM instance and vars copy
+                        action(self, self._private_variables()) # Like in run(), a copy the action may modify
+                        if self._verbose:
+                            self._queue_state_message("STATE_ACTION_EXECUTED", name, {"state_name": name})
                     except Exception as e:
-                        logging.error(f"Error evaluating condition for transition to {t.target_state_name} from {self.current_state.name}: {e}")
-                        self._send_to_client("FSM_ERROR", {"message": f"Condition error for transition from {self.current_state.name}: {str(e)}"})
-                        self.stop(); break 
-                    
-                    if self._stop_event.is_set(): break
-
-                    if can_transit:
-                        transition_to_take = t
-                        break # Found the first (highest priority) valid transition
-                
-                if self._stop_event.is_set(): break # from this inner transition processing loop
-
-                if not transition_to_take:
-                    logging.warning(f"FSM stuck in state {self.current_state.name}: No valid transitions.")
-                    self._send_to_client("FSM_STUCK", {"state_name": self.current_state.name})
-                    self.stop(); break # Break from inner transition processing loop, FSM will stop
-
-                # 2. A transition_to_take has been selected.
-                logging.info(f"Selected transition: {self.current_state.name} -> {transition_to_take.target_state_name}")
-                self._send_to_client("TRANSITION_TAKEN", {
-                    "from_state": self.current_state.name,
-                    "to_state": transition_to_take.target_state_name,
-                    "delay": transition_to_take.delay
-                })
-
-                if transition_to_take.action:
-                    logging.info(f"Executing action for transition: {self.current_state.name} -> {transition_to_take.target_state_name}")
+                        self._report_error(f"Action error in state {name}", e); break
+
+                if self._stop_event.is_set(): break
+
+                if is_finish:
+                    logger.info("Reached finish state: %s", name)
+                    self._queue_to_client("FSM_FINISHED", {"finish_state": name})
+                    break
+
+                # Same as in run(): repeated until a transition is completed, the FSM stops or gets stuck
+                while not self._stop_event.is_set():
+                    self._re_evaluate_event.clear()
                     try:
-                        with self._variable_lock: # Action might read/write live vars
-                            transition_to_take.action(self.variables) 
-                        self._send_to_client("TRANSITION_ACTION_EXECUTED", {
-                            "from_state": self.current_state.name,
-                            "to_state": transition_to_take.target_state_name
-                        })
+                        taken = step(sid, self.variables)
                     except Exception as e:
-                        logging.error(f"Error executing transition action: {e}")
-                        self._send_to_client("FSM_ERROR", {"message": f"Transition action error: {str(e)}"})
-                        self.stop(); break # Break from inner transition processing loop
+                        self._report_error(f"Condition error for transition from {name}", e); break
 
-                if self._stop_event.is_set(): break
+                    if taken is None:
+                        logger.warning(f"FSM stuck in state {name}: No valid transitions.")
+                        self._queue_to_client("FSM_STUCK", {"state_name": name})
+                        stuck = True
+                        self.stop(); break
 
-                # 3. Handle delay for transition_to_take
-                if transition_to_take.delay > 0:
-                    self._current_delay_target_transition = transition_to_take
-                    # transition.delay is in seconds
-                    delay_seconds = transition_to_take.delay / 1000.0 # Convert milliseconds to seconds
-                    self._current_delay_end_time = time.time() + delay_seconds
-                    
-                    logging.info(f"Starting delay for {delay_seconds:.2f}ms for transition to {transition_to_take.target_state_name}")
-                    
-                    needs_re_evaluation = False
-                    while not self._stop_event.is_set() and time.time() < self._current_delay_end_time:
-                        remaining_delay = self._current_delay_end_time - time.time()
-                        if remaining_delay <= 0: break # Delay naturally ended
-
-                        wait_duration = min(0.1, remaining_delay) # Check frequently
-                        
-                        # _re_evaluate_event.wait clears the event if it returns True
-                        if self._re_evaluate_event.wait(timeout=wait_duration):
-                            if self._stop_event.is_set(): break # Prioritize stop event
-                            
-                            logging.info(f"Re-evaluation signaled during delay for transition to "
-                                         f"{self._current_delay_target_transition.target_state_name}. Restarting transition search for state {self.current_state.name}.")
-                            needs_re_evaluation = True
-                            break # Exit delay loop to re-evaluate all transitions from current_state
-                    
-                    # Clear current delay tracking information as this delay attempt is over
-                    self._current_delay_target_transition = None
-                    self._current_delay_end_time = None
-
-                    if self._stop_event.is_set(): break # Break from inner transition processing loop
-
-                    if needs_re_evaluation:
-                        # _re_evaluate_event is already cleared by wait().
-                        # Continue to the top of this inner "Transition evaluation..." loop
-                        # to re-scan all transitions from self.current_state.
-                        continue 
-
-                    # If we are here, delay completed naturally (or was very short) without stop or re-evaluation.
-                    # Check if time is up, effectively.
-                    if time.time() < self._current_delay_end_time if self._current_delay_end_time else False: # Defensive check, should mean loop exited for other reason
-                        logging.warning("Delay loop for transition exited prematurely without re-evaluation or stop signal, before time was up. Re-evaluating.")
-                        continue
-
-
-                    logging.info(f"Delay completed for transition to {transition_to_take.target_state_name}.")
-                    # Proceed to change state (handled below this if-block)
-
-                # 4. If delay is zero or completed (and not re-evaluating/stopped), perform the state change.
-                # (Current delay tracking already cleared if delay was active)
-                if transition_to_take.target_state_name not in self.states:
-                    logging.error(f"Target state '{transition_to_take.target_state_name}' not found!")
-                    self._send_to_client("FSM_ERROR", {"message": f"Target state '{transition_to_take.target_state_name}' not found."})
-                    self.stop(); break # Break from inner transition processing loop
-
-                logging.info(f"Completing transition: {self.current_state.name} -> {transition_to_take.target_state_name}")
-                self.current_state = self.states[transition_to_take.target_state_name]
-                # Successfully transitioned, break inner loop to process the new current_state in outer loop
-                break 
-            
-            # End of inner "Transition evaluation..." loop.
-            # If this loop broke due to stop(), the outer loop's stop_event check will catch it.
-            # If it broke due to a state change, the outer loop continues with the new current_state.
-
-        # FSM execution loop has ended
-        if self._stop_event.is_set() and not self.current_state.is_finish_state : # only send FSM_STOPPED if not already finished
-             # Check if FSM_FINISHED or FSM_STUCK already explains the stop
-            is_stuck = (self.current_state and not self.current_state.is_finish_state and
-                        not any(t.condition(self, self.variables.copy()) for t in self.current_state.transitions))
-            if not is_stuck : # Avoid duplicate FSM_STUCK vs FSM_STOPPED messages if stuck caused stop.
-                logging.info("FSM run loop terminated by stop event.")
+                    next_sid, delay = taken
+                    target_name = states[next_sid][0]
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info("Selected transition: %s -> %s", name, target_name)
+                    self._queue_to_client("TRANSITION_TAKEN", {"from_state": name, "to_state": target_name, "delay": delay})
+
+                    if delay > 0:
+                        needs_re_evaluation = self._wait_for_delay(delay, taken, name, target_name)
+                        if self._stop_event.is_set(): break
+                        if needs_re_evaluation: continue
+
+                    sid = next_sid
+                    break
+
+                self._flush_to_client() # One write per processed state
+
+            self._flush_to_client()
+            if self._stop_event.is_set() and not stuck and not states[sid][2]:
+                logger.info("FSM run loop terminated by stop event.")
                 self._send_to_client("FSM_STOPPED", {"message": "FSM was stopped."})
-        
-        self._cleanup()
+        finally:
+            self._cleanup()
+
+    def _report_error(self, context, error):
+        """
+        Handles an exception raised by user code (an action or condition) of the running FSM:
+        logs it, reports it to the client with FSM_ERROR and stops the FSM.
+
+        Args:
+            context (str): What failed, e.g. "Action error in state A".
+            error (Exception): The exception raised.
+        """
+        logger.error(f"{context}: {error}")
+        self._queue_to_client("FSM_ERROR", {"message": f"{context}: {str(error)}"})
+        self.stop()
 
     def stop(self):
-        logging.info("Stop requested for FSM.")
+        logger.info("Stop requested for FSM.")
         self._stop_event.set()
         # Also signal re-evaluate to break any current delay wait immediately
         self._re_evaluate_event.set() 
+        # And wake up the client handler blocked in select()
+        try:
+            self._wake_w.send(b'x')
+        except OSError:
+            pass # Wake-up already pending or FSM already cleaned up
 
     def _cleanup(self):
-        logging.info("FSM cleaning up...")
+        logger.info("FSM cleaning up...")
+        if self._print_batching:
+            self._print_batching = False
+            _set_print_batching(False) # Also writes the remaining output
         # Clear any pending delay info, FSM is stopping.
         self._current_delay_target_transition = None
-        self._current_delay_end_time = None
 
+        if self._writer_thread:
+            # Let the writer send everything queued so far (e.g. FSM_STOPPED) and exit
+            with self._send_lock:
+                data = bytes(self._send_buf)
+                self._send_buf.clear()
+            if not data or self._put_when_sent(data, closing=True):
+                self._put_when_sent(None, closing=True)
+            # Wait as long as the writer makes progress, a slow client still gets everything
+            last_size = None
+            give_up_time = time.monotonic() + 1.0
+            while self._writer_thread.is_alive() and self._connected and not self._client_stalled:
+                self._writer_thread.join(timeout=0.1)
+                size = self._send_q.qsize()
+                if last_size is None or size < last_size:
+                    last_size = size
+                    give_up_time = time.monotonic() + 1.0
+                elif time.monotonic() >= give_up_time:
+                    break
+            if not self._connected:
+                self._writer_thread.join(timeout=1.0) # Disconnected, it just drains the queue
+            if self._writer_thread.is_alive():
+                logger.warning("Client writer thread did not terminate gracefully.")
+
+        with self._connection_lock:
+            self._connected = False
         if self._client_socket:
             try:
                 # Avoid sending if socket already seems problematic or FSM ended with specific message
@@ -402,6 +1244,9 @@ class FSM:
         if self._client_handler_thread and self._client_handler_thread.is_alive():
             self._client_handler_thread.join(timeout=1.0) 
             if self._client_handler_thread.is_alive():
-                logging.warning("Client handler thread did not terminate gracefully.")
+                logger.warning("Client handler thread did not terminate gracefully.")
+
+        self._wake_r.close()
+        self._wake_w.close()
         
-        logging.info("FSM has shut down.")
\ No newline at end of file
+        logger.info("FSM has shut down.")
\ No newline at end of file
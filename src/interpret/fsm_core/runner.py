@@ -0,0 +1,99 @@
+import logging
+import multiprocessing
+import socket
+
+from .fsm_core import FSM
+
+logger = logging.getLogger(__name__)
+
+def main(fsm_name, step, states, start_state_id, initial_variables, variables_class=None,
+         host='localhost', port=65432):
+    """
+    Runs a generated FSM: connects to the client and runs it with FSM.run_compiled.
+
+    Shared by all generated scripts, so they only contain the FSM specific parts and this
+    code is compiled once, not with every generated script.
+
+    Args:
+        fsm_name (str): Name of the FSM, for the console output.
+        step (callable): Transition function, see FSM.run_compiled.
+        states (sequence): State table, see FSM.run_compiled.
+        start_state_id (int): Id of the start state.
+        initial_variables (dict): Initial values of the FSM variables, by name.
+        variables_class (type, optional): Variables subclass of the FSM, see FSM.
+        host (str, optional): Address to wait for the client on. Defaults to 'localhost'.
+        port (int, optional): Port to wait for the client on. Defaults to 65432.
+    """
+    # 1. Create the FSM instance
+    fsm = FSM(variables_class=variables_class)
+
+    # 2. Set Initial Variables
+    for name, value in initial_variables.items():
+        fsm.set_variable(name, value)
+
+    # 3. Connect to client and Run the FSM
+    print(f"Starting FSM '{fsm_name}'...")
+    fsm.connect_to_client(host=host, port=port)
+
+    if fsm._client_socket: # Check if connection was successful
+        try:
+            fsm.run_compiled(step, states, start_state_id)
+        except KeyboardInterrupt:
+            print("\nFSM execution interrupted by user (Ctrl+C).")
+            fsm.stop()
+        except Exception as e:
+            logger.error(f"An unexpected error occurred during FSM execution: {e}", exc_info=True)
+            fsm.stop()
+        finally:
+            fsm.stop() # Ensure stop is called
+            print("FSM runner script finished.")
+    else:
+        print("FSM did not connect to a client. Exiting.")
+
+def _serve_client(build_fsm, server_socket, conn, addr):
+    """Worker process of serve_many(): runs a new FSM for one client connection."""
+    # Inherited from (fork) or sent by (spawn) the server. Kept open it would keep accepting
+    # connections into the backlog while this worker lives, which nobody would ever serve.
+    server_socket.close()
+    fsm = build_fsm()
+    fsm.attach_client(conn, addr)
+    try:
+        fsm.run()
+    finally:
+        fsm.stop()
+
+def serve_many(build_fsm, host='localhost', port=65432):
+    """
+    Serves any number of clients, each by its own FSM in its own process.
+
+    The FSMs run in separate processes (not threads), so they do not share the GIL and
+    use all cores. Runs until interrupted (Ctrl+C).
+
+    Args:
+        build_fsm (callable): Returns a new FSM with its states added, ready for FSM.run
+                              (e.g. with FSM.from_tables). It is called in the worker
+                              process, so it has to be a module-level function.
+        host (str, optional): Address to accept clients on. Defaults to 'localhost'.
+        port (int, optional): Port to accept clients on. Defaults to 65432.
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        server_socket.bind((host, port))
+        server_socket.listen()
+        # Wakes accept() once a second to reap finished workers (no zombies between clients)
+        server_socket.settimeout(1.0)
+        print(f"FSM Server: Serving clients on {host}:{port}...")
+        while True:
+            multiprocessing.active_children() # Joins the finished workers
+            try:
+                conn, addr = server_socket.accept()
+            except socket.timeout:
+                continue
+            worker = multiprocessing.Process(target=_serve_client, args=(build_fsm, server_socket, conn, addr))
+            worker.start()
+            conn.close() # The worker has its own copy of the connection
+    except KeyboardInterrupt:
+        print("\nFSM server interrupted by user (Ctrl+C).")
+    finally:
+        server_socket.close()
@@ -113,10 +113,11 @@ QString to_python_value_literal(const std::string& val_str) {
 
 QString transform_to_local_vars(const QString& code, const std::vector<VariableInfo>& variables) {
     QString result;
+    // Variables the code does not mention need neither loading nor publishing
+    QStringList used = referenced_variables(code, variables);
 
-    for (const auto& var_info : variables) {
-        QString var_name = QString::fromStdString(var_info.name);
-        result += result +  var_name + " = variables.get('" + var_name + "')\n";
+    for (const auto& var_name : used) {
+        result += var_name + " = variables." + variable_slot_name(var_name, variables) + "\n";
     }
     result += "\n";
 
@@ -124,9 +125,9 @@ QString transform_to_local_vars(const QString& code, const std::vector<VariableI
 
     result += "\n";
 
-    for (const auto& var_info : variables) {
-        QString var_name = QString::fromStdString(var_info.name);
-        result += "fsm.set_variable('" + var_name + "', " + var_name + ")\n";
+    for (const auto& var_name : used) {
+        // Publish only variables the action changed
+        result += "if " + var_name + " is not variables." + variable_slot_name(var_name, variables) + ": fsm.set_variable('" + var_name + "', " + var_name + ")\n";
     }
 
     //for (const auto& var_pair : variables) {
@@ -136,18 +137,105 @@ QString transform_to_local_vars(const QString& code, const std::vector<VariableI
     return result;
 }
 
-// Helper to replace variable names in code with variables.get('<name>')
-QString replace_variables_with_get(const QString& code, const std::vector<VariableInfo>& variables) {
-    QString result = code;
+// Helper to check whether a state action does nothing (same rules as in generate())
+bool is_pass_action(const std::string& action) {
+    QString code = QString::fromStdString(action).trimmed();
+    return code.isEmpty() || code.startsWith("# Enter code here:");
+}
+
+// Helper to find the states that only pass control on to their successor
+std::map<std::string, std::string> fusible_states(const Automaton& automaton) {
+    std::map<std::string, std::string> result;
+    for (const auto& state : automaton.getStates()) {
+        if (state.first == automaton.getStartName() || automaton.isFinalState(state.first) || !is_pass_action(state.second)) {
+            continue;
+        }
+        std::vector<Transition> transitions = automaton.getTransitionsFrom(state.first);
+        if (transitions.empty()) {
+            continue;
+        }
+        // The first transition is always taken at once, the others never
+        const Transition& first = transitions.front();
+        if (first.condition.empty() && first.delay == 0 && first.toState != state.first) {
+            result[state.first] = first.toState;
+        }
+    }
+    return result;
+}
+
+// Helper to name the slot of a variable in the generated Variables subclass
+QString variable_slot_name(const QString& name, const std::vector<VariableInfo>& variables) {
+    // "get" and names starting with "_" would shadow (or, with "__", be mangled into) attributes
+    // of the class, those variables get a prefixed slot name no other variable has
+    if (name != "get" && !name.startsWith('_')) {
+        return name;
+    }
+    QString slot = "v_" + name;
+    auto taken = [&](const QString& candidate) {
+        return std::any_of(variables.begin(), variables.end(),
+                           [&](const VariableInfo& v) { return QString::fromStdString(v.name) == candidate; });
+    };
+    while (taken(slot)) {
+        slot += "_";
+    }
+    return slot;
+}
+
+// Helper to find which of the variables are used in code
+QStringList referenced_variables(const QString& code, const std::vector<VariableInfo>& variables) {
+    QStringList result;
     for (const auto& var_info : variables) {
         QString var_name = QString::fromStdString(var_info.name);
-        // Using word boundaries to avoid partial replacements
         QRegularExpression re("\\b" + QRegularExpression::escape(var_name) + "\\b");
-        result.replace(re, "variables.get('" + var_name + "')");
+        if (code.contains(re)) {
+            result.append(var_name);
+        }
     }
     return result;
 }
 
+// Helper to check that a condition is plain arithmetic/comparison (no calls, strings or attributes)
+bool is_numeric_expression(const QString& code) {
+    static const QRegularExpression not_numeric("[\"'\\[\\]{}]|\\.\\s*[A-Za-z_]|\\b[A-Za-z_]\\w*\\s*\\(");
+    return !code.contains(not_numeric);
+}
+
+// Helper to check that code calls no functions or methods (its result only depends on the variables)
+bool is_pure_expression(const QString& code) {
+    static const QRegularExpression call("\\b[A-Za-z_]\\w*\\s*\\(|\\)\\s*\\(");
+    return !code.contains(call);
+}
+
+// Helper to check that a condition only compares variables and number literals (it cannot raise)
+bool is_non_raising_expression(const QString& code, const std::vector<VariableInfo>& variables) {
+    static const QRegularExpression number("\\b\\d+(\\.\\d*)?([eE][-+]?\\d+)?\\b|\\.\\d+");
+    static const QRegularExpression name("\\b[A-Za-z_]\\w*\\b");
+    static const QRegularExpression operators("^(==|!=|<=|>=|<|>|\\(|\\))*$");
+    static const QRegularExpression ordering("<|>");
+    static const QStringList keywords = {"and", "or", "not", "is", "True", "False"};
+
+    bool ordered = true; // Ordering comparisons only cannot raise for numbers
+    QString rest = code;
+    rest.replace(number, " ");
+    QRegularExpressionMatchIterator names = name.globalMatch(rest);
+    while (names.hasNext()) {
+        QString word = names.next().captured(0);
+        if (keywords.contains(word)) {
+            continue;
+        }
+        auto var = std::find_if(variables.begin(), variables.end(),
+                                [&](const VariableInfo& v) { return QString::fromStdString(v.name) == word; });
+        if (var == variables.end()) {
+            return false; // Unknown names (functions, None, ...) might raise or be anything
+        }
+        // An empty initial value is None and a non-numeric one a string, even for a number type
+        QString initial = to_python_value_literal(var->value);
+        ordered = ordered && var->type != VarDataType::String && initial != "None" && !initial.startsWith('"');
+    }
+    rest.replace(name, " ");
+    rest.remove(QRegularExpression("\\s"));
+    return rest.contains(operators) && (ordered || !rest.contains(ordering));
+}
 
 InterpretGenerator::InterpretGenerator(QObject *parent)
     : QObject{parent}
@@ -156,21 +244,13 @@ InterpretGenerator::InterpretGenerator(QObject *parent)
 }
 
 void InterpretGenerator::generate(const Automaton& automaton, const QString& output_filename) {
-    QDir().mkpath(QFileInfo(output_filename).absolutePath()); // Ensure directory exists
-
-    QFile file(output_filename);
-
-    if (!file.open(QIODevice::WriteOnly | QIODevice::Text)) {
-        qWarning() << "Failed to open file for writing:" << output_filename;
-        return;
-    }
-
-    QTextStream outfile(&file);
+    // The script is built in memory first, so it is only written if it changed
+    QString content;
+    QTextStream outfile(&content);
 
     // --- Collect all function names ---
     std::map<QString, QString> functions;
     std::map<QString, QString> state_action;
-    functions["condition_always_true"] = "return True"; // default condition with no action
 
     for (const auto& pair : automaton.getStates()) {
         if (!pair.second.empty()) { // action
@@ -196,20 +276,12 @@ void InterpretGenerator::generate(const Automaton& automaton, const QString& out
         }
     }
 
-    for (const auto& transition : automaton.getTransitions()) {
-        if (!transition.condition.empty()) {
-            QString function_name = "condition_" + sanitize_python_identifier(transition.condition);
-            QString condition_code = replace_variables_with_get(QString::fromStdString(transition.condition), automaton.getVariables());
-            condition_code = "return (" + condition_code + ")";
-
-            functions[function_name] = condition_code;
-        }
-    }
-
     // --- Python code generation ---
-    outfile << "from fsm_core import FSM, State, Transition\n";
-    outfile << "import time\n";
-    outfile << "import logging\n\n";
+    outfile << "from fsm_core import Variables, njit_if_available, buffered_print, runner\n";
+    outfile << "import functools\n";
+    outfile << "import time    # Available to action code\n";
+    outfile << "import logging # Available to action code\n\n";
+    outfile << "print = buffered_print # Output of actions is written in batches while the FSM runs\n\n";
 
     outfile << "# --- FSM Name: " << QString::fromStdString(automaton.getName()) << " ---\n";
     if (!automaton.getDescription().empty()) {
@@ -217,6 +289,27 @@ void InterpretGenerator::generate(const Automaton& automaton, const QString& out
     }
     outfile << "\n";
 
+    if (!automaton.getVariables().empty()) {
+        outfile << "# --- FSM Variables ---\n\n";
+        outfile << "class _Vars(Variables):\n";
+        outfile << "    \"\"\"Variables of the FSM, actions and step() read them as attributes.\"\"\"\n";
+        QStringList slot_names;
+        QStringList renamed;
+        for (const auto& var_info : automaton.getVariables()) {
+            QString var_name = QString::fromStdString(var_info.name);
+            QString slot = variable_slot_name(var_name, automaton.getVariables());
+            slot_names.append(to_python_string_literal(slot.toStdString()));
+            if (slot != var_name) {
+                renamed.append(to_python_string_literal(var_info.name) + ": " + to_python_string_literal(slot.toStdString()));
+            }
+        }
+        outfile << "    __slots__ = (" << slot_names.join(", ") << (slot_names.size() == 1 ? ",)" : ")") << "\n";
+        if (!renamed.isEmpty()) {
+            outfile << "    _renamed = {" << renamed.join(", ") << "}\n";
+        }
+        outfile << "\n\n";
+    }
+
     outfile << "# --- Define FSM Actions and Conditions ---\n\n";
 
     for (const auto& func : functions) {
@@ -227,106 +320,274 @@ void InterpretGenerator::generate(const Automaton& automaton, const QString& out
         outfile << "\n\n";
     }
 
-    outfile << "# --- Main FSM Execution ---\n";
-    outfile << "if __name__ == \"__main__\":\n";
-    outfile << "    # 1. Create the FSM instance\n";
-
-    QString fsm_name = sanitize_python_identifier(automaton.getName());
-    outfile << "    " << fsm_name << " = FSM()\n\n";
+    // --- Fuse states that only pass control on into the transitions leading to them ---
+    const std::map<std::string, std::string> fusible = fusible_states(automaton);
+    std::map<std::string, std::string> fused;
+    for (const auto& pair : fusible) {
+        // A chain of such states running into a cycle of them would never be left, the whole
+        // chain is kept as it is. The walk visits the chain once, in the unmodified map, so the
+        // result does not depend on the order of the states.
+        std::set<std::string> seen{pair.first};
+        std::string next = pair.second;
+        while (fusible.count(next) && seen.insert(next).second) {
+            next = fusible.at(next);
+        }
+        if (!fusible.count(next)) {
+            fused[pair.first] = pair.second; // The chain ends in a state that is kept
+        }
+    }
+    auto resolve = [&fused](std::string name) {
+        while (fused.count(name)) {
+            name = fused.at(name);
+        }
+        return name;
+    };
 
-    outfile << "    # 2. Define States\n";
+    // --- Keep only the states reachable from the start state ---
     std::unordered_map<string, string> states = automaton.getStates();
+    std::set<std::string> reachable;
+    std::vector<std::string> pending{automaton.getStartName()};
+    while (!pending.empty()) {
+        std::string name = pending.back();
+        pending.pop_back();
+        if (!states.count(name) || !reachable.insert(name).second) {
+            continue;
+        }
+        for (const auto& t : automaton.getTransitionsFrom(name)) {
+            pending.push_back(resolve(t.toState));
+        }
+    }
 
-    for (const auto& state : states) {
-        QString py_state_name = sanitize_python_identifier(state.first);
-        outfile << "    state_" << py_state_name << " = State(\n";
-        outfile << "        name=" << to_python_string_literal(state.first) << ",\n";
-
+    // --- Compiled FSM: state table and transition function ---
+    // States get ids in name order, so the same automaton always gives the same ids
+    std::vector<std::string> state_names(reachable.begin(), reachable.end());
 
-        outfile << "        action=" << state_action[QString::fromStdString(state.first)] << ",\n";
-        outfile << "        is_start_state=" << (state.first == automaton.getStartName() ? "True" : "False") << ",\n";
-        outfile << "        is_finish_state=" << (automaton.isFinalState(state.first) ? "True" : "False") << "\n";
-        outfile << "    )\n";
+    std::map<std::string, int> state_ids;
+    for (size_t i = 0; i < state_names.size(); ++i) {
+        state_ids[state_names[i]] = static_cast<int>(i);
     }
 
-    outfile << "\n";
+    outfile << "# --- Compiled FSM ---\n";
+    outfile << "# (name, action, is_finish_state) of every state, the state id is the index\n";
+    outfile << "STATES = (\n";
+    for (const auto& name : state_names) {
+        outfile << "    (" << to_python_string_literal(name) << ", "
+                << state_action[QString::fromStdString(name)] << ", "
+                << (automaton.isFinalState(name) ? "True" : "False") << "), # "
+                << state_ids[name] << "\n";
+    }
+    outfile << ")\n";
 
-    outfile << "    # 3. Define Transitions\n";
+    auto start = state_ids.find(automaton.getStartName());
+    outfile << "START_STATE_ID = " << (start != state_ids.end() ? start->second : -1) << "\n\n";
 
-    int tr_counter = 0;
+    // With numeric variables only, the transition function can be compiled to native code
+    // (numba, if installed), it then gets the variable values as arguments instead of the dict
+    bool numeric = !automaton.getVariables().empty();
+    for (const auto& var_info : automaton.getVariables()) {
+        numeric = numeric && var_info.type != VarDataType::String;
+    }
     for (const auto& t : automaton.getTransitions()) {
-        QString py_from_state = sanitize_python_identifier(t.fromState);
-        QString py_to_state = sanitize_python_identifier(t.toState);
-        QString tr_var_name = "tr_" + py_from_state + "_to_" + py_to_state + "_" + QString::number(tr_counter++);
+        numeric = numeric && is_numeric_expression(QString::fromStdString(t.condition));
+    }
 
-        outfile << "    " << tr_var_name << " = Transition(\n";
-        outfile << "        target_state_name=" << to_python_string_literal(t.toState) << ",\n";
+    QStringList var_names;
+    for (const auto& var_info : automaton.getVariables()) {
+        var_names.append(QString::fromStdString(var_info.name));
+    }
 
-        QString cond_func = "condition_always_true"; // Default
-        if (!t.condition.empty()) {
-            cond_func = "condition_" + sanitize_python_identifier(t.condition); // this is error prone but whatever
+    // A state testing 2 to 4 distinct plain predicates gets a dense table instead of a chain
+    // of ifs: the truth values of its predicates index its (next state id, delay) entries.
+    // All predicates are evaluated, so they must not raise where the chain would not have
+    // evaluated them (e.g. "x == 0" guarding "10 / x > 1")
+    std::map<std::string, QStringList> table_predicates;
+    for (const auto& name : state_names) {
+        std::vector<Transition> transitions = automaton.getTransitionsFrom(name);
+        QStringList predicates;
+        bool plain = true;
+        for (const auto& t : transitions) {
+            QString condition = QString::fromStdString(t.condition);
+            if (condition.isEmpty()) {
+                break; // Transitions after an unconditional one can never be taken
+            }
+            plain = plain && is_non_raising_expression(condition, automaton.getVariables());
+            if (!predicates.contains(condition)) {
+                predicates.append(condition);
+            }
         }
-        outfile << "        condition=" << cond_func << ",\n";
-
-        outfile << "        delay=" << t.delay << ".0\n"; // Ensure it's a float
-        outfile << "    )\n";
+        if (!plain || predicates.size() < 2 || predicates.size() > 4) {
+            continue;
+        }
+        table_predicates[name] = predicates;
+
+        QStringList entries;
+        for (int mask = 0; mask < (1 << predicates.size()); ++mask) {
+            QString entry = numeric ? "(-1, 0.0)" : "None";
+            for (const auto& t : transitions) {
+                QString condition = QString::fromStdString(t.condition);
+                auto target = state_ids.find(resolve(t.toState));
+                if ((!condition.isEmpty() && !(mask & (1 << predicates.indexOf(condition)))) || target == state_ids.end()) {
+                    continue;
+                }
+                entry = "(" + QString::number(target->second) + ", " + QString::number(t.delay) + ".0)";
+                break; // First transition that can be taken wins, like in the chain of ifs
+            }
+            entries.append(entry);
+        }
+        outfile << "_TABLE_" << state_ids[name] << " = (" << entries.join(", ") << ") # " << QString::fromStdString(name) << "\n";
+    }
+    if (!table_predicates.empty()) {
+        outfile << "\n";
     }
-    outfile << "\n";
 
+    // Chain of ifs returning the transition taken from a state, one line per transition
+    auto transition_chain = [&](const std::string& name, const QString& indent) {
+        QString chain;
+        for (const auto& t : automaton.getTransitionsFrom(name)) {
+            auto target = state_ids.find(resolve(t.toState));
+            if (target == state_ids.end()) {
+                qWarning() << "Transition to unknown state skipped:" << QString::fromStdString(t.toState);
+                continue;
+            }
 
-    outfile << "    # 4. Add Transitions to States\n";
+            QString taken = "return (" + QString::number(target->second) + ", " + QString::number(t.delay) + ".0)";
+            if (t.condition.empty()) {
+                chain += indent + taken + "\n";
+                break; // Transitions after an unconditional one can never be taken
+            }
+            chain += indent + "if (" + QString::fromStdString(t.condition) + "): " + taken + "\n";
+        }
+        return chain;
+    };
 
-    tr_counter = 0; // Reset for matching variable names
-    for (const auto& t : automaton.getTransitions()) {
-        QString py_from_state_var = "state_" + sanitize_python_identifier(t.fromState);
-        QString py_from_state_name_sanitized = sanitize_python_identifier(t.fromState);
-        QString py_to_state_name_sanitized = sanitize_python_identifier(t.toState);
-        QString tr_var_name = "tr_" + py_from_state_name_sanitized + "_to_" + py_to_state_name_sanitized + "_" + QString::number(tr_counter++);
-        outfile << "    " << py_from_state_var << ".add_transition(" << tr_var_name << ")\n";
+    // Without calls, the conditions of a state only depend on the variables they reference,
+    // so the transition taken for the same variable values can be memoized
+    std::map<std::string, QStringList> memoized_args;
+    for (const auto& name : state_names) {
+        std::vector<Transition> transitions = automaton.getTransitionsFrom(name);
+        if (numeric || table_predicates.count(name) || transitions.empty() || transitions.front().condition.empty()) {
+            continue; // Native code, table lookup, nothing to evaluate or always the first transition
+        }
+        QString conditions;
+        bool pure = true;
+        for (const auto& t : transitions) {
+            if (t.condition.empty()) {
+                break;
+            }
+            conditions += QString::fromStdString(t.condition) + "\n";
+            pure = pure && is_pure_expression(QString::fromStdString(t.condition));
+        }
+        if (!pure) {
+            continue;
+        }
+        QStringList args = referenced_variables(conditions, automaton.getVariables());
+        memoized_args[name] = args;
+
+        outfile << "\n@functools.lru_cache(maxsize=64)\n";
+        outfile << "def _pick_" << state_ids[name] << "(" << args.join(", ") << "):\n";
+        outfile << "    \"\"\"Transition taken from " << QString::fromStdString(name) << " for the given variable values, or None.\"\"\"\n";
+        outfile << transition_chain(name, "    ");
+        outfile << "    return None\n\n";
     }
-    outfile << "\n";
 
+    if (numeric) {
+        outfile << "@njit_if_available\n";
+        outfile << "def _step_numeric(sid, " << var_names.join(", ") << "):\n";
+        outfile << "    \"\"\"step() for numeric variables, returns (-1, 0.0) instead of None.\"\"\"\n";
+    } else {
+        outfile << "def step(sid, variables):\n";
+        outfile << "    \"\"\"Returns (next state id, delay) of the transition to take from state sid, or None.\"\"\"\n";
+    }
 
-    outfile << "    # 5. Add States to FSM\n";
+    bool first_branch = true;
+    for (const auto& name : state_names) {
+        std::vector<Transition> transitions = automaton.getTransitionsFrom(name);
+        if (transitions.empty()) {
+            continue; // No branch, falls through to "return None" (stuck or finish state)
+        }
 
-    for (const auto& state : states) {
-        QString state_name = sanitize_python_identifier(state.first);
-        QString py_state_var = "state_" + state_name;
-        outfile << "    " << fsm_name << ".add_state(" << py_state_var << ")\n";
-    }
-    outfile << "\n";
+        outfile << "    " << (first_branch ? "if" : "elif") << " sid == " << state_ids[name] << ": # " << QString::fromStdString(name) << "\n";
+        first_branch = false;
+
+        auto memoized = memoized_args.find(name);
+        if (memoized != memoized_args.end()) {
+            QStringList args;
+            for (const auto& var_name : memoized->second) {
+                args.append("variables." + variable_slot_name(var_name, automaton.getVariables()));
+            }
+            outfile << "        return _pick_" << state_ids[name] << "(" << args.join(", ") << ")\n";
+            continue;
+        }
+
+        if (!numeric) {
+            // Load each variable used by the conditions of this state only once
+            QString conditions;
+            for (const auto& t : transitions) {
+                conditions += QString::fromStdString(t.condition) + "\n";
+            }
+            for (const auto& var_name : referenced_variables(conditions, automaton.getVariables())) {
+                outfile << "        " << var_name << " = variables." << variable_slot_name(var_name, automaton.getVariables()) << "\n";
+            }
+        }
 
+        auto table = table_predicates.find(name);
+        if (table != table_predicates.end()) {
+            QStringList bits;
+            for (int i = 0; i < static_cast<int>(table->second.size()); ++i) {
+                bits.append("bool(" + table->second[i] + ")" + (i ? " << " + QString::number(i) : QString()));
+            }
+            outfile << "        return _TABLE_" << state_ids[name] << "[" << bits.join(" | ") << "]\n";
+            continue;
+        }
 
-    outfile << "    # 6. Set Initial Variables\n";
-    if (automaton.getVariables().empty()) {
-        outfile << "    # No initial variables defined in specification.\n";
+        outfile << transition_chain(name, "        ");
     }
+
+    if (numeric) {
+        outfile << "    return (-1, 0.0)\n\n";
+        outfile << "def step(sid, variables):\n";
+        outfile << "    \"\"\"Returns (next state id, delay) of the transition to take from state sid, or None.\"\"\"\n";
+        outfile << "    taken = _step_numeric(sid";
+        for (const auto& var_name : var_names) {
+            outfile << ", variables." << variable_slot_name(var_name, automaton.getVariables());
+        }
+        outfile << ")\n";
+        outfile << "    return taken if taken[0] >= 0 else None\n\n\n";
+    } else {
+        outfile << "    return None\n\n\n";
+    }
+
+    outfile << "# --- Main FSM Execution ---\n";
+    outfile << "if __name__ == \"__main__\":\n";
+    // The driver code is the same for all automata, it lives in fsm_core.runner
+    QStringList initial_variables;
     for (const auto& var_info : automaton.getVariables()) {
-        outfile << "    " << fsm_name << ".set_variable("
-                << to_python_string_literal(var_info.name) << ", "
-                << to_python_value_literal(var_info.value) << ")\n";
+        initial_variables.append(to_python_string_literal(var_info.name) + ": " + to_python_value_literal(var_info.value));
     }
-    outfile << "\n";
+    QString fsm_name = sanitize_python_identifier(automaton.getName());
+    outfile << "    runner.main(" << to_python_string_literal(fsm_name.toStdString()) << ", step, STATES, START_STATE_ID, {"
+            << initial_variables.join(", ") << "}"
+            << (automaton.getVariables().empty() ? "" : ", variables_class=_Vars") << ")\n";
+    outfile.flush();
+
+    QByteArray data = content.toUtf8();
+    QFile existing(output_filename);
+    if (existing.open(QIODevice::ReadOnly | QIODevice::Text) && existing.readAll() == data) {
+        // Same automaton as the last run, keeping the file untouched keeps Python's
+        // bytecode cache and the numba cache of the script valid
+        return;
+    }
+    existing.close();
+
+    QDir().mkpath(QFileInfo(output_filename).absolutePath()); // Ensure directory exists
+
+    QFile file(output_filename);
 
-    outfile << "    # 7. Connect to client and Run the FSM\n";
-    outfile << "    client_host = 'localhost'\n";
-    outfile << "    client_port = 65432 # Default port, change if needed\n\n";
-    outfile << "    print(f\"Starting FSM '" << fsm_name << "'...\")\n";
-    outfile << "    " << fsm_name << ".connect_to_client(host=client_host, port=client_port)\n\n";
-    outfile << "    if " << fsm_name << "._client_socket: # Check if connection was successful\n";
-    outfile << "        try:\n";
-    outfile << "            " << fsm_name << ".run()\n";
-    outfile << "        except KeyboardInterrupt:\n";
-    outfile << "            print(\"\\nFSM execution interrupted by user (Ctrl+C).\")\n";
-    outfile << "            " << fsm_name << ".stop()\n";
-    outfile << "        except Exception as e:\n";
-    outfile << "            logging.error(f\"An unexpected error occurred during FSM execution: {e}\", exc_info=True)\n";
-    outfile << "            " << fsm_name << ".stop()\n";
-    outfile << "        finally:\n";
-    outfile << "            " << fsm_name << ".stop() # Ensure stop is called\n";
-    outfile << "            print(\"FSM runner script finished.\")\n";
-    outfile << "    else:\n";
-    outfile << "        print(\"FSM did not connect to a client. Exiting.\")\n";
+    if (!file.open(QIODevice::WriteOnly | QIODevice::Text)) {
+        qWarning() << "Failed to open file for writing:" << output_filename;
+        return;
+    }
 
+    file.write(data);
     file.close();
 }
@@ -8,8 +8,8 @@
  * includes utility functions for sanitizing strings, escaping Python literals, and transforming
  * code to work with Python dictionaries.
  * 
- * The generated Python scripts include state and transition definitions, action and condition
- * functions, and code to run the FSM and connect to a client.
+ * The generated Python scripts include the state actions, a state table with a compiled
+ * transition function (step), and code to run the FSM and connect to a client.
  * 
  * The utility functions provided in this file help ensure that the generated Python code is
  * valid, safe, and adheres to Python syntax rules.
@@ -29,8 +29,10 @@
 #include <QObject>
 #include <QFile>
 #include <QTextStream>
+#include <QStringList>
 #include <algorithm> // For std::replace, std::remove_if
 #include <set>       // For ordered unique function names
+#include <map>
 
 #include "spec_parser/automaton-data.hpp"
 
@@ -62,8 +64,9 @@ QString to_python_string_literal(const std::string& s);
 QString to_python_value_literal(const std::string& val_str);
 
 /**
- * @brief Generates Python code that creates local variables from the variables dictionary,
- * inserts the user action code, and writes back the local variables to the dictionary.
+ * @brief Generates Python code that creates local variables from the FSM variables object,
+ * inserts the user action code, and writes back the local variables the code changed.
+ * Only the variables the code references are loaded and written back.
  * 
  * @param code The user action code.
  * @param variables The map of variable names and their default values.
@@ -72,13 +75,81 @@ QString to_python_value_literal(const std::string& val_str);
 QString transform_to_local_vars(const QString& code, const std::vector<VariableInfo>& variables);
 
 /**
- * @brief Replaces variable names in code with variables.get('<name>').
+ * @brief Checks whether a state action does nothing (empty or only the editor placeholder).
  * 
- * @param code The code in which to replace variable names.
+ * @param action The state action code.
+ * @return bool True if the action is generated as "pass".
+ */
+bool is_pass_action(const std::string& action);
+
+/**
+ * @brief Finds the states that can be fused into the transitions leading to them.
+ * 
+ * Such a state is neither the start nor a finish state, does nothing on entry and its first
+ * outgoing transition has no condition and no delay, so the FSM always leaves it at once.
+ * 
+ * @param automaton The automaton.
+ * @return std::map<std::string, std::string> The fusible states mapped to their successor.
+ */
+std::map<std::string, std::string> fusible_states(const Automaton& automaton);
+
+/**
+ * @brief Names the slot that holds a variable in the generated Variables subclass.
+ * 
+ * It is the variable name, unless that would clash with an attribute of the class ("get",
+ * names starting with an underscore); such a variable gets a prefixed name no other
+ * variable has, listed in the _renamed map of the class.
+ * 
+ * @param name The variable name.
+ * @param variables The map of variable names.
+ * @return QString The slot name of the variable.
+ */
+QString variable_slot_name(const QString& name, const std::vector<VariableInfo>& variables);
+
+/**
+ * @brief Finds which variables are referenced in code.
+ * 
+ * @param code The code to search (e.g. a transition condition).
  * @param variables The map of variable names.
- * @return QString The code with variables replaced by variables.get().
+ * @return QStringList Names of the variables found in code, in the order of variables.
+ */
+QStringList referenced_variables(const QString& code, const std::vector<VariableInfo>& variables);
+
+/**
+ * @brief Checks whether a condition only does arithmetic and comparisons.
+ * 
+ * Such conditions (no function calls, strings, attributes or indexing) can be compiled
+ * to native code together with the rest of the transition function.
+ * 
+ * @param code The condition code.
+ * @return bool True if the condition is a plain numeric expression.
+ */
+bool is_numeric_expression(const QString& code);
+
+/**
+ * @brief Checks that a condition cannot raise an exception when evaluated.
+ * 
+ * Such a condition only compares variables and number literals (==, !=, is, and, or, not);
+ * ordering comparisons (<, >, <=, >=) only if all of its variables are numbers with a numeric
+ * initial value (an empty one is None). It can therefore be evaluated even where a chain of
+ * ifs would not have reached it.
+ * 
+ * @param code The condition code.
+ * @param variables The map of variable names.
+ * @return bool True if the condition cannot raise.
+ */
+bool is_non_raising_expression(const QString& code, const std::vector<VariableInfo>& variables);
+
+/**
+ * @brief Checks that code calls no functions or methods.
+ * 
+ * The value of such a condition only depends on the variables it references, so it can be
+ * memoized by their values.
+ * 
+ * @param code The condition code.
+ * @return bool True if the code contains no calls.
  */
-QString replace_variables_with_get(const QString& code, const std::vector<VariableInfo>& variables);
+bool is_pure_expression(const QString& code);
 
 class InterpretGenerator : public QObject
 {
@@ -95,8 +166,11 @@ public:
     /**
      * @brief Generates a Python FSM script from the given Automaton and writes it to the specified file.
      * 
-     * The generated script includes state and transition definitions, action and condition functions,
-     * and code to run the FSM and connect to a client.
+     * The generated script includes the state actions, a state table (STATES) and a transition
+     * function (step) with all transition conditions inlined, and a call of fsm_core.runner.main,
+     * which connects to a client and runs the FSM with FSM.run_compiled. If the file already holds the same script
+     * (the automaton did not change since the last run), it is not rewritten, so the caches
+     * Python and numba keep for it stay valid.
      * 
      * @param automaton The Automaton to generate the Python script from.
      * @param output_filename The path to the output Python file.
@@ -1,69 +1,252 @@
+import os
 import socket
+import selectors
+import signal
+import stat
 import json
 import threading
 import time
 import sys
+import struct
+
+# JSON codec of the messages: orjson if installed, else ujson, else the standard json module.
+# dumps returns bytes; loads takes bytes and raises a ValueError subclass on invalid JSON.
+try:
+    import orjson # Optional, much faster JSON codec than the standard json module
+    dumps = orjson.dumps
+    loads = orjson.loads
+except ImportError:
+    try:
+        import ujson # Optional, slower than orjson but still faster than the json module
+        def dumps(obj):
+            return ujson.dumps(obj).encode('utf-8')
+        loads = ujson.loads
+    except ImportError:
+        def dumps(obj):
+            return json.dumps(obj).encode('utf-8')
+        _decode = json.JSONDecoder().decode
+        def loads(data):
+            # Messages are UTF-8, so json.loads' encoding detection and argument checks are skipped
+            return _decode(data.decode('utf-8'))
 
 FSM_HOST = 'localhost'
 FSM_PORT = 65432 # Make sure this matches the port in fsm_runner.py
 
+# Run with --length for an FSM created with FSM(framing='length'): every message is preceded
+# by its length (u32, big-endian) instead of ending with a newline (see CommunicationProtocol.md)
+LENGTH_FRAMING = '--length' in sys.argv[1:]
+LENGTH_HEADER = struct.Struct('>I')
+
+# Run with --pretty to print the received messages parsed and indented, instead of as received
+PRETTY = '--pretty' in sys.argv[1:]
+
 # Event to signal threads to stop
 stop_event = threading.Event()
 
+# Pipe the sender waits on together with stdin, written to by set_stop() so it wakes up at once.
+# Windows can only select sockets, there the sender blocks in input() instead.
+if sys.platform != 'win32':
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_w, False)
+else:
+    wake_r = wake_w = None
+
+def set_stop():
+    """Sets stop_event and wakes the sender if it is waiting for input."""
+    stop_event.set()
+    if wake_w is not None:
+        try:
+            os.write(wake_w, b"\0")
+        except BlockingIOError:
+            pass # Pipe full, the sender is woken up already
+
+# Characters a number can start with, and the words float() accepts besides numbers
+NUMBER_START = frozenset('+-.0123456789')
+FLOAT_WORDS = frozenset(('inf', 'infinity', 'nan'))
+
 def parse_value(value_str):
     """Tries to parse a string into int, float, bool, or keeps it as string."""
     value_str = value_str.strip()
-    if value_str.lower() == 'true':
+    lowered = value_str.lower()
+    if lowered == 'true':
         return True
-    if value_str.lower() == 'false':
+    if lowered == 'false':
         return False
-    try:
-        return int(value_str)
-    except ValueError:
+    # Only try the conversions that can succeed, raising exceptions is slow
+    if value_str[:1] in NUMBER_START:
         try:
-            return float(value_str)
+            return int(value_str)
         except ValueError:
-            return value_str # Keep as string if other parses fail
+            pass
+    elif lowered not in FLOAT_WORDS:
+        return value_str
+    try:
+        return float(value_str)
+    except ValueError:
+        return value_str # Keep as string if other parses fail
+
+def encode_message(message):
+    """Encodes a message for the server, framed as set by LENGTH_FRAMING."""
+    body = dumps(message)
+    if LENGTH_FRAMING:
+        return LENGTH_HEADER.pack(len(body)) + body
+    return body + b"\n"
+
+# Constant messages are encoded only once
+STOP_FSM_MESSAGE = {"type": "STOP_FSM", "payload": {}}
+STOP_FSM_FRAME = encode_message(STOP_FSM_MESSAGE)
+
+def read_messages(sock_file):
+    """
+    Yields the raw JSON messages read from the server, framed as set by LENGTH_FRAMING.
+    Stops when the server closes the connection.
+    """
+    if not LENGTH_FRAMING:
+        yield from iter(sock_file.readline, b'')
+        return
+    while True:
+        header = sock_file.read(LENGTH_HEADER.size)
+        if len(header) < LENGTH_HEADER.size:
+            return
+        (length,) = LENGTH_HEADER.unpack(header)
+        message = sock_file.read(length)
+        if len(message) < length:
+            return
+        yield message
+
+# Received messages are written to a buffered writer of stdout's file descriptor without flushing
+# it, a flusher thread flushes it at most OUTPUT_DELAY seconds later, so bursts of messages are
+# printed at once. sys.stdout itself (print(), the prompts of the sender) is left as it is.
+OUTPUT_DELAY = 0.05
+output_pending = threading.Event()
+
+def flush_output(out):
+    """Flushes out shortly after receive_messages writes to it. Runs in a separate thread."""
+    while output_pending.wait():
+        time.sleep(OUTPUT_DELAY)
+        output_pending.clear()
+        out.flush()
 
 def receive_messages(sock):
     """
     Receives messages from the FSM server and prints them.
     Runs in a separate thread.
     """
-    buffer = ""
+    # Framing is done by the buffered reader of the socket file. It blocks until a whole
+    # message arrives; on exit, the main thread shuts the socket down to wake it up.
+    sock_file = sock.makefile('rb', buffering=65536)
+    sys.stdout.flush() # Everything printed so far goes before the messages
     try:
-        while not stop_event.is_set():
-            try:
-                # Set a timeout so the loop can check stop_event
-                sock.settimeout(0.5)
-                data = sock.recv(4096)
-                if not data:
-                    print("\n[Client] Server closed the connection.")
-                    break
-                
-                buffer += data.decode('utf-8')
-                
-                while '\n' in buffer:
-                    message_str, buffer = buffer.split('\n', 1)
-                    if not message_str.strip():
-                        continue
-                    try:
-                        message = json.loads(message_str)
-                        print(f"[FSM -> Client] {json.dumps(message, indent=2)}")
-                    except json.JSONDecodeError:
-                        print(f"[Client] Received invalid JSON: {message_str}")
-
-            except socket.timeout:
-                continue # Allows checking stop_event
-            except (socket.error, ConnectionResetError) as e:
-                print(f"\n[Client] Socket error: {e}. Disconnecting.")
-                break
-            except Exception as e:
-                print(f"\n[Client] Error receiving message: {e}")
+        out = open(sys.stdout.fileno(), 'wb', buffering=65536, closefd=False)
+    except (AttributeError, OSError): # Redirected to a stream without a file descriptor
+        out = sys.stdout.buffer
+    threading.Thread(target=flush_output, args=(out,), daemon=True).start()
+    # Bound methods used for every message, looked up only once
+    stop_is_set = stop_event.is_set
+    write = out.write
+    set_output_pending = output_pending.set
+    try:
+        for raw_message in read_messages(sock_file):
+            if stop_is_set():
                 break
+            if not raw_message or raw_message.isspace(): # Checked without copying it like strip()
+                continue
+            if not PRETTY: # Received messages are already JSON, no need to parse and re-encode them
+                write(b"[FSM -> Client] " + raw_message.rstrip() + b"\n")
+            else:
+                try:
+                    message = loads(raw_message) # Parsed from bytes, no need to decode first
+                    line = f"[FSM -> Client] {json.dumps(message, indent=2)}\n"
+                except ValueError: # JSONDecodeError or invalid UTF-8
+                    line = f"[Client] Received invalid JSON: {raw_message.decode('utf-8', 'replace').strip()}\n"
+                write(line.encode('utf-8'))
+            set_output_pending()
+        else:
+            if not stop_event.is_set(): # Not woken up by the shutdown on exit
+                out.flush() # The messages go before the notice
+                print("\n[Client] Server closed the connection.")
+    except (socket.error, ConnectionResetError) as e:
+        if not stop_event.is_set():
+            out.flush()
+            print(f"\n[Client] Socket error: {e}. Disconnecting.")
+    except Exception as e:
+        out.flush()
+        print(f"\n[Client] Error receiving message: {e}")
     finally:
+        sock_file.close()
+        out.flush() # Not closed, the flusher thread may still flush it
         print("[Client] Receiver thread stopping.")
-        stop_event.set() # Signal other threads (like sender) to stop
+        set_stop() # Signal other threads (like sender) to stop
+
+def stop_fsm_command(args):
+    """Builds the message of 'stopfsm'. Returns the message and its encoding."""
+    return STOP_FSM_MESSAGE, STOP_FSM_FRAME
+
+def set_command(args):
+    """
+    Builds the message of 'set <var_name> <var_value>'. Returns the message and its encoding,
+    or None if an argument is missing.
+    """
+    if len(args) != 2:
+        return None
+    var_name, var_value_str = args
+    message = {
+        "type": "SET_VARIABLE",
+        "payload": {"name": var_name, "value": parse_value(var_value_str)}
+    }
+    return message, encode_message(message)
+
+# Commands that send a message, by name: each builds it from the command's arguments
+COMMANDS = {
+    "stopfsm": stop_fsm_command,
+    "set": set_command,
+}
+
+def stdin_selector():
+    """
+    Returns a selector waiting for stdin and for the wake pipe of set_stop(), or None if stdin
+    cannot be waited for that way (Windows, stdin redirected from a file or /dev/null).
+    """
+    if wake_r is None:
+        return None
+    try:
+        fd = sys.stdin.fileno()
+        mode = os.fstat(fd).st_mode
+    except (AttributeError, OSError, ValueError): # No stdin, or one without a file descriptor
+        return None
+    # Regular files are always readable and epoll refuses them, so only these are selected
+    if not (os.isatty(fd) or stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode)):
+        return None
+    sel = selectors.DefaultSelector()
+    try:
+        sel.register(fd, selectors.EVENT_READ)
+        sel.register(wake_r, selectors.EVENT_READ)
+    except OSError:
+        sel.close()
+        return None
+    return sel
+
+def input_lines(sel):
+    """
+    Yields the lines read from stdin, waiting for them with sel (see stdin_selector).
+    Stops at the end of input or when set_stop() wakes it up.
+    """
+    fd = sys.stdin.fileno()
+    partial = b''
+    while True:
+        if any(key.fd == wake_r for key, _ in sel.select()):
+            return
+        # Read whatever is available at once, a line can only be split across two reads.
+        # Reading lines with a buffered reader could leave lines in its buffer that the
+        # selector does not see.
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            if partial:
+                yield partial # Last line without a newline
+            return
+        *lines, partial = (partial + chunk).split(b"\n")
+        for line in lines:
+            yield line + b"\n"
 
 def send_messages(sock):
     """
@@ -75,57 +258,60 @@ def send_messages(sock):
     print("  'quit' to exit this client")
     print("-----------------------------------------")
 
+    sel = None
     try:
+        # Wait for input with a selector, so the loop also stops as soon as set_stop() is
+        # called (e.g. the server closed the connection). Without one, input is read line by
+        # line and stop_event is checked between the lines.
+        sel = stdin_selector()
+        lines = input_lines(sel) if sel is not None else None
+        interactive = sys.stdin is not None and sys.stdin.isatty()
+
         while not stop_event.is_set():
             try:
-                # Use a timeout for input to allow checking stop_event periodically
-                # This is tricky with blocking input(), so we'll rely on user typing 'quit'
-                # or receiver thread signaling stop.
-                # A more robust solution might use select() on stdin for non-blocking input.
-                
-                # For simplicity, input() will block. User needs to press Enter.
-                if sys.stdin.isatty(): # Check if input is from a terminal
+                if lines is not None:
+                    if interactive:
+                        print("> ", end="", flush=True)
+                    line = next(lines, b'')
+                    if not line:
+                        if stop_event.is_set(): # Woken up by set_stop()
+                            break
+                        raise EOFError
+                    command_str = line.decode('utf-8', 'replace')
+                elif interactive:
                     command_str = input("> ")
-                else: # If input is piped, read line by line, or just wait for stop_event
-                    time.sleep(0.1) # Don't busy-wait if not interactive
-                    if stop_event.is_set(): break
-                    continue
-
+                else:
+                    command_str = sys.stdin.readline()
+                    if not command_str:
+                        raise EOFError
 
                 if stop_event.is_set(): # Check after input attempt
                     break
 
-                if not command_str.strip():
+                stripped = command_str.strip()
+                if not stripped:
                     continue
 
-                parts = command_str.strip().lower().split(maxsplit=2)
-                command = parts[0]
-                message_to_send = None
+                # Only the command is case-insensitive, variable names and values keep their case
+                parts = stripped.split(maxsplit=2)
+                command = parts[0].lower()
 
                 if command == "quit":
                     print("[Client] Quitting...")
                     break
-                elif command == "stopfsm":
-                    message_to_send = {"type": "STOP_FSM", "payload": {}}
-                elif command == "set" and len(parts) == 3:
-                    var_name = parts[1]
-                    var_value_str = parts[2]
-                    var_value = parse_value(var_value_str)
-                    message_to_send = {
-                        "type": "SET_VARIABLE",
-                        "payload": {"name": var_name, "value": var_value}
-                    }
-                else:
-                    print(f"[Client] Unknown command or incorrect format: '{command_str}'")
+                build_message = COMMANDS.get(command)
+                built = build_message(parts[1:]) if build_message else None
+                if built is None:
+                    print(f"[Client] Unknown command or incorrect format: '{stripped}'")
                     continue
+                message_to_send, encoded_message = built
 
-                if message_to_send:
-                    try:
-                        sock.sendall((json.dumps(message_to_send) + "\n").encode('utf-8'))
-                        print(f"[Client -> FSM] Sent: {json.dumps(message_to_send)}")
-                    except socket.error as e:
-                        print(f"[Client] Error sending message: {e}. Connection may be lost.")
-                        break
+                try:
+                    sock.sendall(encoded_message)
+                    print(f"[Client -> FSM] Sent: {json.dumps(message_to_send)}")
+                except socket.error as e:
+                    print(f"[Client] Error sending message: {e}. Connection may be lost.")
+                    break
             except EOFError: # Happens if input is piped and ends
                 print("[Client] EOF received, quitting sender.")
                 break
@@ -135,32 +321,75 @@ def send_messages(sock):
 
 
     finally:
+        if sel is not None:
+            sel.close()
         print("[Client] Sender loop stopping.")
         stop_event.set() # Ensure other threads know to stop
 
-if __name__ == "__main__":
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        print(f"[Client] Attempting to connect to FSM at {FSM_HOST}:{FSM_PORT}...")
-        client_socket.connect((FSM_HOST, FSM_PORT))
+def request_stop(signum, frame):
+    """Handler of SIGINT and SIGTERM: stops the client like the 'quit' command."""
+    set_stop()
+
+class FSMClient:
+    """
+    Connection to the FSM together with its receiver thread.
+
+    Used as a context manager: connects and starts receiving on enter, stops the receiver
+    and closes the socket on exit.
+    """
+    def __init__(self, host=FSM_HOST, port=FSM_PORT):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.receiver_thread = None
+
+    def __enter__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Large socket buffers, set before connect so the TCP window scale is negotiated for them
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+        if hasattr(socket, 'TCP_USER_TIMEOUT'): # Linux only
+            # Fail sends after 5 s without an acknowledgement instead of hanging on a dead server
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, 5000)
+        try:
+            print(f"[Client] Attempting to connect to FSM at {self.host}:{self.port}...")
+            self.sock.connect((self.host, self.port))
+        except socket.error:
+            self.sock.close()
+            raise
+        # Send each command at once instead of holding it back to coalesce small packets (Nagle)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         print("[Client] Connected to FSM.")
 
-        receiver_thread = threading.Thread(target=receive_messages, args=(client_socket,), daemon=True)
-        receiver_thread.start()
+        self.receiver_thread = threading.Thread(target=receive_messages, args=(self.sock,), daemon=True)
+        self.receiver_thread.start()
+        return self
 
-        # Run sender in the main thread or create another thread for it
-        # For simplicity, run in main thread. It will block on input().
-        send_messages(client_socket)
+    def __exit__(self, exc_type, exc_value, traceback):
+        stop_event.set() # Signal all threads to stop
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR) # Wakes the receiver blocked in readline
+        except OSError:
+            pass # Already closed by the server
+        self.receiver_thread.join(timeout=1.0) # Wait for receiver to finish
 
+        print("[Client] Closing socket.")
+        self.sock.close()
+        return False # Exceptions are propagated
+
+if __name__ == "__main__":
+    if sys.platform != 'win32':
+        # set_stop() wakes the sender waiting for input, so Ctrl+C stops both threads the same
+        # way. On Windows input() blocks the sender, so KeyboardInterrupt is kept there.
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+    try:
+        with FSMClient() as client:
+            # Run sender in the main thread, the receiver runs in its own thread
+            send_messages(client.sock)
     except socket.error as e:
         print(f"[Client] Could not connect to FSM: {e}")
     except KeyboardInterrupt:
         print("\n[Client] Ctrl+C detected, shutting down client.")
     finally:
-        stop_event.set() # Signal all threads to stop
-        if 'receiver_thread' in locals() and receiver_thread.is_alive():
-            receiver_thread.join(timeout=1.0) # Wait for receiver to finish
-
-        print("[Client] Closing socket.")
-        client_socket.close()
-        print("[Client] Exited.")
\ No newline at end of file
+        print("[Client] Exited.")